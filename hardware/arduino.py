@@ -1,25 +1,41 @@
-import collections
 import numpy as np
-import pyqtgraph as pg
 from PyQt5 import QtCore
 import serial
-import struct
 import threading
 import time
 
+from hardware import sensor_protocol
 import utility.conversions as conversions
+from utility.ring_buffer import RingBuffer
+
+START_TIMEOUT = 10.
+ADC_BITS = 15
+ADC_RANGE = 6.144  # V, ADS1115 at GAIN_TWOTHIRDS
+DEFAULT_SAMPLE_PERIOD = 0.035  # free running rate of the board with four channels at 128 SPS
+HIGH_RATE_PERIOD = 0.005  # four channels at 860 SPS
+READ_INTERVAL = 0.05  # serial reads happen at least this often so that the OS buffer does not overflow
+MIN_HISTORY = 2.  # s
+DEFAULT_CHANNEL_KINDS = ('irradiance', 'irradiance', 'temperature', 'irradiance')
+# conversion of the ADC voltage of an analog input by channel kind, voltage_range is the supply voltage of the board
+CONVERSIONS = {'irradiance': lambda voltage, voltage_range: conversions.voltage_to_power_array(voltage),
+               'temperature': conversions.voltage_to_temperature_array,
+               'voltage': lambda voltage, voltage_range: voltage}
+MAX_CLOCK_DRIFT = 1e-2  # bound on the rate error of the board clock, ceramic resonators are within 0.5 %
 
 
 class Arduino(QtCore.QObject):
     update = QtCore.pyqtSignal()
     to_log = QtCore.pyqtSignal(str)
+    finished = QtCore.pyqtSignal()
+    samples_ready = QtCore.pyqtSignal(object)  # rows of time and channels, emitted from the reader thread
+    receiving = QtCore.pyqtSignal()  # once per run from the reader thread, at the first frames or after START_TIMEOUT
 
     def __init__(self, serial_port='COM3', mode='continuous', serial_baud=38400, n_data_points=100, data_num_bytes=2,
-                 n_ai=4, query_period=0.25, fixed_time=60., supply_voltage=5.2):
+                 n_ai=4, query_period=0.25, fixed_time=60., supply_voltage=5.2, sample_period=DEFAULT_SAMPLE_PERIOD,
+                 raw_path=None, channel_kinds=DEFAULT_CHANNEL_KINDS):
         super(Arduino, self).__init__()
 
         self.port = serial_port
-        self.supply_voltage = supply_voltage
         self.mode = mode
         self.query_period = query_period
         self.fixed_time = fixed_time
@@ -29,25 +45,65 @@ class Arduino(QtCore.QObject):
         self.baud = serial_baud
         self.data_num_bytes = data_num_bytes
         self.n_ai = n_ai
+        # a kind of CONVERSIONS for each analog input, e.g. 'temperature' (thermistor) or 'irradiance' (photodiode)
+        self.channel_kinds = [channel_kinds[i] if i < len(channel_kinds) else 'irradiance' for i in range(n_ai)]
+        unknown = sorted(set(self.channel_kinds) - set(CONVERSIONS))
+        if unknown:
+            raise ValueError('Unknown sensor channel kind %s, expected one of %s.' % (', '.join(unknown),
+                                                                                     ', '.join(CONVERSIONS)))
+        self.lookup_tables = []
+        self.supply_voltage = supply_voltage  # builds the lookup tables
 
-        self.raw_data = bytearray(self.n_ai * self.data_num_bytes)
-        self.data_type = 'h'  # 2 byte integer
-        self.data = [collections.deque(maxlen=self.n_data_points) for _ in range(self.n_ai)]
-        self.times = [collections.deque(maxlen=self.n_data_points) for _ in range(self.n_ai)]
+        self.frame_dtype = sensor_protocol.frame_dtype(self.n_ai)
+        self.requested_period = sample_period
+        self.sample_period = max(sample_period, sensor_protocol.min_period(self.baud, self.frame_dtype))
+        # the board streams faster than it is polled, keep the same time span of full rate history
+        self.history_length = int(np.ceil(max(self.n_data_points * self.query_period, MIN_HISTORY) /
+                                          self.sample_period))
+        self.raw_path = raw_path
+        self.raw_file = None
+        self.serial_buffer = bytearray()
+        self.last_sequence = None
+        self.last_ticks = None
+        self.clock_offset = None
+        self.last_sample_time = -np.inf
+        self.n_frames = 0
+        self.n_dropped = 0
+        self.n_corrupt_bytes = 0
+        self.history = RingBuffer(1 + self.n_ai, self.history_length)  # time row shared by the channel rows
         self.init_time = time.time()
 
+        self.last_frame_time = None
         self.is_run = True
         self.is_receiving = False
+        self.abort_event = threading.Event()
+        self.receiving_event = threading.Event()
         self.serial_thread = None
         self.serialConnection = None
 
+    @property
+    def supply_voltage(self):
+        return self._supply_voltage
+
+    @supply_voltage.setter
+    def supply_voltage(self, value):
+        self._supply_voltage = value
+        self.update_lookup_tables()
+
+    def update_lookup_tables(self):
+        # raw code -> physical value for each channel, the thermistor depends on the supply voltage
+        tables = {kind: conversions.lookup_table(CONVERSIONS[kind], bits=ADC_BITS, adc_range=ADC_RANGE,
+                                                 voltage_range=self.supply_voltage)
+                  for kind in set(self.channel_kinds)}
+        self.lookup_tables = [tables[kind] for kind in self.channel_kinds]
+
     def config_serial(self):
         if str(self.port) == 'dummy':
             return
         self.to_log.emit('<span style=\" color:#000000;\" >Trying to connect to Arduino at ' + str(self.port) +
                          '.</span>')
         try:
-            self.serialConnection = serial.Serial(self.port, self.baud, timeout=4)
+            self.serialConnection = serial.Serial(self.port, self.baud, timeout=0)
             self.to_log.emit('<span style=\" color:#32cd32;\" >Connected to Arduino at ' + str(self.port) +
                              '.</span>')
         except serial.serialutil.SerialException:
@@ -57,76 +113,125 @@ class Arduino(QtCore.QObject):
             return
 
     def read_serial_start(self):
+        # returns at once, receiving is emitted once values come in
         self.is_run = True
         if self.serial_thread is None:
             self.serial_thread = threading.Thread(target=self.background_thread)
             self.serial_thread.start()
-            # Block till we start receiving values
-            while not self.is_receiving:
-                time.sleep(0.1)
+
+    def start_receiving(self):
+        # called from the reader thread, the start-up is over, with or without values
+        if not self.receiving_event.is_set():
+            self.receiving_event.set()
+            self.receiving.emit()
+
+    def config_board(self):
+        if self.sample_period > self.requested_period:
+            self.to_log.emit('<span style=\" color:#ff0000;\" >Sample period limited to %.1f ms by the serial baud '
+                             'rate.</span>' % (self.sample_period * 1e3))
+        if str(self.port) == 'dummy':
+            return
+        self.serialConnection.write(sensor_protocol.period_command(self.sample_period))
+        if self.raw_path is not None:
+            self.raw_file = open(self.raw_path, 'ab')
 
     def background_thread(self):  # retrieve data
+        start_time = time.time()
         self.config_serial()
-        time.sleep(1.0)  # give some buffer time for retrieving data
+        self.abort_event.wait(1.0)  # give some buffer time for retrieving data
         n = 0
+        try:
+            self.config_board()
+        except serial.serialutil.SerialException:
+            pass  # reported as lost connection by the first read
+        last_update = 0.
         while self.is_run:
             if str(self.port) == 'dummy':
                 self.is_receiving = True
             else:
                 try:
-                    self.serialConnection.reset_input_buffer()
-                    self.serialConnection.readinto(self.raw_data)
-                    self.is_receiving = True
+                    self.read_frames()
                 except (AttributeError, serial.serialutil.SerialException):
                     self.port = 'dummy'
                     self.is_run = False
                     self.to_log.emit('<span style=\" color:#ff0000;\" >Lost connection to Arduino. Check connection '
                                      'and refresh COM ports.</span>')
-            self.update.emit()
-            if self.mode == 'fixed':
-                n += 1
-                self.is_run = False if n >= self.n_data_points else True
-            time.sleep(self.query_period)
+            if self.is_receiving or time.time() - start_time >= START_TIMEOUT:
+                self.start_receiving()
+            if time.time() - last_update >= self.query_period:
+                last_update = time.time()
+                self.update.emit()
+                if self.mode == 'fixed':
+                    n += 1
+                    self.is_run = False if n >= self.n_data_points else True
+            if self.abort_event.wait(min(self.query_period, READ_INTERVAL)):
+                break
+        if self.raw_file is not None:
+            self.raw_file.close()
+        self.start_receiving()
+        self.finished.emit()
 
-    def close(self):
+    def read_frames(self):
+        # take whatever the board has streamed since the last call, an incomplete frame stays in serial_buffer
+        self.serial_buffer += self.serialConnection.read(self.serialConnection.in_waiting)
+        frames, n_consumed, n_skipped = sensor_protocol.decode_frames(self.serial_buffer, self.frame_dtype)
+        del self.serial_buffer[:n_consumed]
+        self.n_corrupt_bytes += n_skipped
+        if len(frames) == 0:
+            return frames
+        if self.raw_file is not None:
+            frames.tofile(self.raw_file)
+        self.n_dropped += sensor_protocol.dropped_frames(frames['sequence'], self.last_sequence)
+        self.last_sequence = int(frames['sequence'][-1])
+        self.n_frames += len(frames)
+        self.ingest(frames)
+        self.is_receiving = True
+        return frames
+
+    def ingest(self, frames):
+        # every frame is converted and stored once, with the device timestamp mapped onto the host clock
+        ticks = sensor_protocol.unwrap_clock(frames['time'], self.last_ticks)
+        elapsed_ticks = 0 if self.last_ticks is None else ticks[-1] - self.last_ticks
+        self.last_ticks = int(ticks[-1])
+        seconds = ticks * sensor_protocol.DEVICE_CLOCK_RESOLUTION
+        self.update_clock_offset(time.time() - self.init_time - seconds[-1],
+                                 elapsed_ticks * sensor_protocol.DEVICE_CLOCK_RESOLUTION, seconds[0])
+        samples = np.empty((1 + self.n_ai, len(frames)))
+        samples[0] = seconds + self.clock_offset
+        self.last_sample_time = samples[0, -1]
+        for channel in range(self.n_ai):
+            samples[1 + channel] = self.convert(channel, frames['channels'][:, channel])
+        self.history.extend(samples)
+        self.last_frame_time = time.time()
+        self.samples_ready.emit(samples)
+
+    def update_clock_offset(self, candidate, elapsed, first_seconds):
+        # The latest frame of a batch taken as received now overestimates the offset by its transfer delay, so the
+        # offset follows the lowest candidates and may rise by at most MAX_CLOCK_DRIFT of the elapsed device time, which
+        # tracks a board clock that runs slow. Host times are then late by at most the smallest recent transfer delay
+        # plus 2 * MAX_CLOCK_DRIFT of the time since that batch, instead of an error that grows for the whole run.
+        if self.clock_offset is None:
+            self.clock_offset = candidate
+            return
+        offset = min(candidate, self.clock_offset + MAX_CLOCK_DRIFT * elapsed)
+        # a lower offset must not move the new samples before the stored ones
+        self.clock_offset = max(offset, self.last_sample_time - first_seconds)
+
+    def convert(self, channel, codes):
+        return self.lookup_tables[channel][codes.view(np.uint16)]
+
+    def stop(self):
+        # returns at once, finished is emitted when the reader thread is done
         self.is_run = False
+        self.abort_event.set()
+
+    def close(self):
+        self.stop()
         if self.serial_thread is not None:
             self.serial_thread.join()
         if not str(self.port) == 'dummy':
             self.serialConnection.close()
             self.to_log.emit('<span style=\" color:#000000;\" >Disconnected serial port...</span>')
 
-    def get_serial_data(self, plt_number):
-        self.times[plt_number].append(time.time() - self.init_time)
-        data = self.raw_data[(plt_number * self.data_num_bytes):(self.data_num_bytes +
-                                                                 plt_number * self.data_num_bytes)]
-        value,  = struct.unpack(self.data_type, data)
-        if plt_number == 2:
-            value = conversions.voltage_to_temperature(conversions.digital_to_voltage(value, bits=15,
-                                                                                      voltage_range=6.144),
-                                                       voltage_range=self.supply_voltage)
-        else:
-            value = conversions.voltage_to_power(conversions.digital_to_voltage(value, bits=15, voltage_range=6.144))
-        self.data[plt_number].append(value)  # we get the latest data point and append it to our array
-        return self.times[plt_number], self.data[plt_number], self.data[plt_number][-1]
-
-    def line_plot(self, target_line=None, channel=None):
-        channels = {'temp': 2, 'power1': 0, 'power2': 1, 'power3': 3}
-        if target_line is None:
-            target_line = pg.PlotCurveItem()
-        if self.port == 'dummy':
-            xval, yval = [], []
-        elif channel in channels.keys():
-            xval, yval, _ = self.get_serial_data(channels[channel])
-        else:
-            xval, yval = [], []
-        target_line.setData(np.array(xval), np.array(yval))
-
-    def get_sensor_latest(self):
-        if not self.port == 'dummy':
-            sensor_time = self.get_serial_data(0)[0][-1]
-            sensor_readout = [self.get_serial_data(i)[2] for i in range(self.n_ai)]
-        else:
-            sensor_time = 0.
-            sensor_readout = [-1.0 for _ in range(self.n_ai)]
-        return sensor_time, sensor_readout
+    def is_live(self, timeout):
+        return self.last_frame_time is not None and time.time() - self.last_frame_time < timeout
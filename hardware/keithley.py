@@ -1,20 +1,58 @@
 import numpy as np
-import pandas as pd
 import pyqtgraph as pg
 from PyQt5 import QtCore
 import pyvisa as visa
 import threading
 import time
 
+from hardware import scpi
+from hardware.simulated_sourcemeter import SimulatedSourcemeter
+from utility.curve_pars import operating_point
+from utility.iv_trace import IVTrace
+
+DATA_FORMATS = {'ascii': ('ASC', None), 'real32': ('REAL,32', 'f'), 'real64': ('REAL,64', 'd')}
+BYTE_ORDERS = {'normal': ('NORM', True), 'swapped': ('SWAP', False)}
+ELEMENTS = ('VOLT', 'CURR', 'RES', 'TIME', 'STAT')  # order in which the 2400 returns trace record elements
+DEFAULT_ELEMENTS = {'isc': ('CURR', 'TIME')}
+NPLC = 0.01
+LINE_FREQUENCY = 50.
+POINT_OVERHEAD = 2e-3  # s per reading on top of the integration time
+EVENT_SUMMARY_BIT = 32  # status byte bit set by *OPC via *ESE 1
+POLL_INTERVAL = 0.01
+MAX_BUFFER_POINTS = 2500
+MAX_LIST_POINTS = 100  # per :SOUR:LIST:VOLT command, further points are appended
+CURRENT_RANGES = (1e-6, 1e-5, 1e-4, 1e-3, 1e-2, 1e-1, 1.)
+RANGE_HEADROOM = 1.2
+OVERFLOW_BIT = 1  # status element bits that send a learned range back to autorange
+COMPLIANCE_BIT = 8
+RANGE_COMPLIANCE_BIT = 65536
+OVERFLOW_VALUE = 9.9e37  # reading returned for a measurement beyond its range
+EARLY_STOP_MARGIN = 2  # grid points swept past the predicted stop, room for the drift of Voc between traces
+
+simulated_sourcemeters = {}  # kept between runs like a real instrument
+
+
+def adaptive_voltages(min_voltage, max_voltage, n_points, centres, width=0.03, base_density=0.15):
+    # place points by inverting the cumulative of a point density that peaks at the given voltages
+    fine = np.linspace(min_voltage, max_voltage, 50 * n_points)
+    density = base_density + np.exp(-0.5 * ((fine[:, np.newaxis] - np.asarray(centres)) / width) ** 2).sum(axis=1)
+    cumulative = np.concatenate(([0.], np.cumsum((density[1:] + density[:-1]) / 2 * np.diff(fine))))
+    return np.interp(np.linspace(0., cumulative[-1], n_points), cumulative, fine)
+
 
 class Keithley(QtCore.QObject):
-    trace_finished = QtCore.pyqtSignal(int, int)
+    trace_finished = QtCore.pyqtSignal(int, int, object)  # trace, cycle and the IVTrace of the trace
     to_log = QtCore.pyqtSignal(str)
     finished = QtCore.pyqtSignal()
+    sweep_started = QtCore.pyqtSignal(float)  # host time
+    sweep_stopped = QtCore.pyqtSignal(int, int, float)  # count of the first trace, number of traces, host time
 
     def __init__(self, gpib_port='GPIB::24::INSTR', mode='fixed', n_data_points=100, averages=5, traces=1,
                  trace_pause=5.0, trigger_delay=0.0, cycles=1, cycle_pause=1.0, min_voltage=-0.01, max_voltage=0.7,
-                 compliance_current=0.5, voltage_protection=20, remote_sense=False, use_rear_terminals=False):
+                 compliance_current=0.5, voltage_protection=20, remote_sense=False, use_rear_terminals=False,
+                 data_format='real32', byte_order='swapped', elements=None, buffered_traces=False,
+                 sweep_spacing='linear', early_stop_points=None, early_stop_chunk=10,
+                 current_range='auto'):
         super(Keithley, self).__init__()
         self.gpib_port = gpib_port
         self.mode = mode
@@ -31,71 +69,129 @@ class Keithley(QtCore.QObject):
         self.voltage_protection = voltage_protection
         self.remote_sense = remote_sense
         self.use_rear_terminals = use_rear_terminals
+        self.data_format = data_format
+        self.byte_order = byte_order
+        if elements is None:
+            elements = DEFAULT_ELEMENTS.get(self.mode, ('VOLT', 'CURR', 'TIME'))
+        # a learned range is fixed from the first autoranged trace and needs the status element to be released again
+        self.learn_range = current_range == 'learned'
+        self.current_range = None  # autorange if None
+        if self.learn_range:
+            elements = tuple(elements) + ('STAT',)
+        self.elements = tuple(element for element in ELEMENTS if element in elements)
         self.times = np.linspace(self.min_voltage, self.max_voltage, num=self.n_data_points)
         self.voltages = np.zeros_like(self.times)
         self.currents = np.zeros_like(self.times)
+        # stop sweeping a number of points after the current changed sign, checked on the host every chunk
+        self.early_stop_points = None if self.mode == 'isc' else early_stop_points
+        self.early_stop_chunk = early_stop_chunk
+        # arm the instrument for all traces of a cycle and read them back in one transfer if they fit the buffer
+        if (buffered_traces and self.mode != 'continuous' and self.early_stop_points is None and
+                self.traces * self.n_data_points <= MAX_BUFFER_POINTS):
+            self.block_traces = self.traces
+        else:
+            self.block_traces = 1
+        self.trace_buffers = np.zeros((self.block_traces, self.n_data_points, len(self.elements)))
+        # the adaptive list sweep starts out linear and is refocused after every acquisition
+        self.sweep_spacing = 'linear' if self.mode == 'isc' else sweep_spacing
+        self.voltage_grid = np.linspace(self.min_voltage, self.max_voltage, num=self.n_data_points)
+        self.source_list = self.voltage_grid if self.sweep_spacing == 'adaptive' else None  # linear sweep if None
 
         self.is_run = True
+        self.abort_event = threading.Event()
+        self.arm_time = time.time()  # host time at which the instrument timestamps were zeroed
         self.gpib_thread = None
         self.sourcemeter = None
 
-        self.rm = visa.ResourceManager()
+        self.rm = None  # only opened for real instruments, the simulator needs no VISA backend
 
     def config_keithley(self):
         if str(self.gpib_port) == 'dummy':
-            return
-        self.to_log.emit('<span style=\" color:#000000;\" >Trying to connect to Keithley at ' + str(self.gpib_port) +
-                         '.</span>')
-        try:
-            self.sourcemeter = self.rm.open_resource(str(self.gpib_port))
-            self.to_log.emit('<span style=\" color:#32cd32;\" >Connected to Keithley at ' + str(self.gpib_port) +
-                             '.</span>')
-        except visa.errors.VisaIOError:
-            self.to_log.emit('<span style=\" color:#ff0000;\" >Failed to connect to Keithley at ' +
+            if self.gpib_port not in simulated_sourcemeters:
+                simulated_sourcemeters[self.gpib_port] = SimulatedSourcemeter()
+            self.sourcemeter = simulated_sourcemeters[self.gpib_port]
+            self.to_log.emit('<span style=\" color:#000000;\" >Using simulated Keithley.</span>')
+        else:
+            self.to_log.emit('<span style=\" color:#000000;\" >Trying to connect to Keithley at ' +
                              str(self.gpib_port) + '.</span>')
-            self.gpib_port = 'dummy'
+            try:
+                if self.rm is None:
+                    self.rm = visa.ResourceManager()
+                self.sourcemeter = self.rm.open_resource(str(self.gpib_port))
+                self.to_log.emit('<span style=\" color:#32cd32;\" >Connected to Keithley at ' + str(self.gpib_port) +
+                                 '.</span>')
+            except (visa.errors.VisaIOError, ValueError):
+                self.to_log.emit('<span style=\" color:#ff0000;\" >Failed to connect to Keithley at ' +
+                                 str(self.gpib_port) + '.</span>')
+                return False
+        if scpi.applied_settings.get(self.gpib_port) and int(float(self.sourcemeter.query("*ESE?"))) != 1:
+            scpi.forget(self.gpib_port)  # power cycled since the last run
+        n_changed = scpi.apply_settings(self.sourcemeter, self.gpib_port, self.settings(), actions=[":TRAC:CLE"])
+        self.to_log.emit('<span style=\" color:#000000;\" >Sent %d Keithley settings.</span>' % n_changed)
+        return True
+
+    def settings(self):
+        n_points = self.n_data_points if self.source_list is None else len(self.source_list)
+        return [(":SYST:BEEP:STAT", "OFF"),
+                (":SOUR:FUNC:MODE", "VOLT"),
+                (":SOUR:SWE:SPAC", "LIN"),
+                (":SOUR:VOLT:STAR", 0.0 if self.mode == 'isc' else self.min_voltage),
+                (":SOUR:VOLT:STOP", 0.0 if self.mode == 'isc' else self.max_voltage),
+                (":SOUR:SWE:POIN", self.n_data_points),
+                (":SOUR:LIST:VOLT", None if self.source_list is None else self.list_value()),
+                (":SOUR:VOLT:MODE", "SWE" if self.source_list is None else "LIST"),
+                (":TRIG:COUN", n_points),
+                (":ARM:SOUR", "TIM" if self.block_traces > 1 else "IMM"),
+                (":ARM:TIM", round(self.sweep_duration(n_points) + self.trace_pause, 3) if self.block_traces > 1
+                 else None),
+                (":ARM:COUN", self.block_traces),
+                (":TRIG:DEL", self.trigger_delay),
+                (":SOUR:DEL", 0.0),
+                (":SOUR:VOLT:RANG", self.voltage_protection),
+                (":SENS:CURR:PROT", self.compliance_current),
+                (":SENS:FUNC:CONC", "OFF"),
+                (":SENS:FUNC", "'CURR'"),
+                (":SENS:CURR:RANG:AUTO", "ON" if self.current_range is None else "OFF"),
+                (":SENS:CURR:RANG", self.current_range),
+                (":SENS:CURR:NPLC", NPLC),
+                (":SENS:AVER:TCON", "REP"),
+                (":SENS:AVER:COUN", self.averages),
+                (":SENS:AVER:STAT", "ON" if self.averages > 1 else "OFF"),
+                (":DISP:ENAB", "OFF"),
+                (":SYST:AZER:STAT", "OFF"),
+                (":ROUT:TERM", "REAR" if self.use_rear_terminals else "FRON"),
+                (":SYST:RSEN", "ON" if self.remote_sense else "OFF"),
+                (":TRAC:POIN", self.block_traces * n_points),
+                (":TRAC:FEED", "SENS"),
+                (":FORM:ELEM", ','.join(self.elements)),
+                (":FORM:DATA", DATA_FORMATS[self.data_format][0]),
+                (":FORM:BORD", BYTE_ORDERS[self.byte_order][0]),
+                ("*ESE", 1)]
+
+    def list_value(self):
+        # lists longer than one command are continued with :APPend, the list is always written as a whole
+        chunks = [','.join('%.4f' % v for v in self.source_list[i:i + MAX_LIST_POINTS])
+                  for i in range(0, len(self.source_list), MAX_LIST_POINTS)]
+        return ';:SOUR:LIST:VOLT:APP '.join(chunks)
+
+    def update_voltage_grid(self):
+        v_oc, v_mpp = operating_point(self.voltages, self.currents)
+        self.voltage_grid = adaptive_voltages(self.min_voltage, self.max_voltage, self.n_data_points,
+                                              [v for v in (0., v_mpp, v_oc) if not np.isnan(v)])
+        self.source_list = self.voltage_grid
+
+    def update_current_range(self):
+        readings = self.trace_buffers.reshape(-1, len(self.elements))
+        if len(readings) == 0:
             return
-        self.sourcemeter.write("*RST")
-        self.sourcemeter.write(":SYST:BEEP:STAT OFF")
-        self.sourcemeter.write(":SOUR:FUNC:MODE VOLT")
-        self.sourcemeter.write("SOUR:SWE:SPAC LIN")
-        if self.mode == 'isc':
-            self.sourcemeter.write(f"SOUR:VOLT:STAR {0.0}")
-            self.sourcemeter.write(f"SOUR:VOLT:STOP {0.0}")
-        else:
-            self.sourcemeter.write(f"SOUR:VOLT:STAR {self.min_voltage}")
-            self.sourcemeter.write(f"SOUR:VOLT:STOP {self.max_voltage}")
-        self.sourcemeter.write(f"SOUR:SWE:POIN {self.n_data_points}")
-        self.sourcemeter.write(":SOUR:VOLT:MODE SWE")
-        self.sourcemeter.write(f"TRIG:COUN {self.n_data_points}")
-        self.sourcemeter.write(":ARM:COUNT 1")
-        self.sourcemeter.write(f":TRIG:DEL {self.trigger_delay}")
-        self.sourcemeter.write(":SOUR:DEL 0.0")
-        self.sourcemeter.write(f":SOUR:VOLT:RANGE {self.voltage_protection}")
-        self.sourcemeter.write(f":SENSE:CURR:PROT {self.compliance_current}")
-        self.sourcemeter.write(":SENSE:FUNC:CONC OFF")
-        self.sourcemeter.write(":SENSE:FUNC 'CURR'")
-        self.sourcemeter.write(":SENSE:CURR:RANG:AUTO ON")  # 0.1")
-        self.sourcemeter.write(":SENSE:CURR:NPLC 0.01")
-        if self.averages > 1:
-            self.sourcemeter.write(":SENSE:AVER:TCON REP")
-            self.sourcemeter.write(f":SENSE:AVER:COUN {self.averages}")
-            self.sourcemeter.write(":SENSE:AVER:STAT ON")
-        else:
-            self.sourcemeter.write(":SENSE:AVER:STAT OFF")
-        self.sourcemeter.write(":DISP:ENAB OFF")
-        self.sourcemeter.write(":SYSTEM:AZERO:STAT OFF")
-        if self.use_rear_terminals:
-            self.sourcemeter.write(":ROUT:TERM REAR")
-        else:
-            self.sourcemeter.write(":ROUT:TERM FRON")
-        if self.remote_sense:
-            self.sourcemeter.write(":SYST:RSEN ON;")
-        else:
-            self.sourcemeter.write(":SYST:RSEN OFF;")
-        self.sourcemeter.write(":TRAC:CLE")
-        self.sourcemeter.write(f":TRAC:POIN {self.n_data_points}")
-        self.sourcemeter.write(":TRAC:FEED SENS")
+        status = self.get_element(readings, 'STAT').astype(np.int64)
+        if np.any(status & (OVERFLOW_BIT | COMPLIANCE_BIT | RANGE_COMPLIANCE_BIT)):
+            if self.current_range is not None:
+                self.to_log.emit('<span style=\" color:#ff0000;\" >Current out of range, back to autorange.</span>')
+            self.current_range = None
+        elif self.current_range is None:
+            needed = RANGE_HEADROOM * np.max(np.abs(self.get_element(readings, 'CURR')))
+            self.current_range = next((r for r in CURRENT_RANGES if r >= needed), CURRENT_RANGES[-1])
 
     def read_keithley_start(self):
         self.is_run = True
@@ -104,66 +200,190 @@ class Keithley(QtCore.QObject):
             self.gpib_thread.start()
 
     def background_thread(self):
-        self.config_keithley()
+        try:
+            if self.config_keithley():
+                self.run_scan()
+        finally:
+            self.disconnect()
+            self.is_run = False
+            self.finished.emit()
+
+    def run_scan(self):
+        # all waits return early once stop() sets the abort event
         for cycle in range(1 if self.mode == 'continuous' else self.cycles):
-            time.sleep(5.0)  # give time for sensor connection to re-establish itself
-            for trace in self.zero_to_infinity() if self.mode == 'continuous' else range(self.traces):
-                if not self.is_run:
-                    self.to_log.emit('<span style=\" color:#ff0000;\" >Scan aborted.</span>')
-                    return
-                if str(self.gpib_port) == 'dummy':
-                    for dp in range(self.n_data_points):
-                        time.sleep(self.trigger_delay)
-                        self.times[dp] = time.time()
+            if self.abort_event.wait(5.0):  # give time for sensor connection to re-establish itself
+                break
+            for first_trace in (self.zero_to_infinity() if self.mode == 'continuous' else
+                                range(0, self.traces, self.block_traces)):
+                self.sweep_started.emit(time.time())
+                if self.early_stop_points is None:
+                    self.trace_buffers = self.acquire()
                 else:
-                    self.sourcemeter.write(":OUTPUT ON")
-                    self.sourcemeter.write(":TRAC:FEED:CONT NEXT")
-                    self.sourcemeter.write(":INIT")
-                    time.sleep(self.n_data_points / 100 + (self.averages / 5))
-                    self.sourcemeter.write(":OUTPUT OFF")
-                    data = self.sourcemeter.query_ascii_values("TRAC:DATA?")
-                    self.voltages = data[0::5]
-                    self.currents = [-dp for dp in data[1::5]]
-                    self.times = data[3::5]
-                self.trace_finished.emit(trace, cycle)
-                self.to_log.emit('<span style=\" color:#1e90ff;\" >Finished trace %s of cycle %s.</span>'
-                                 % (str(trace + 1), str(cycle + 1)))
-                time.sleep(self.trace_pause)
+                    self.trace_buffers = self.acquire_until_voc()[np.newaxis]
+                self.sweep_stopped.emit(cycle * self.traces + first_trace, len(self.trace_buffers), time.time())
+                if self.abort_event.is_set():
+                    break
+                for trace, trace_buffer in enumerate(self.trace_buffers, start=first_trace):
+                    if self.overflowed(trace_buffer):
+                        self.to_log.emit('<span style=\" color:#ff0000;\" >Trace %s of cycle %s is out of range and '
+                                         'was skipped.</span>' % (str(trace + 1), str(cycle + 1)))
+                        continue
+                    self.voltages, self.currents, self.times = self.split_trace(trace_buffer)
+                    # the receiver gets its own copy, the buffers and arm_time are reused by the next acquisition
+                    self.trace_finished.emit(trace, cycle, self.get_keithley_data(trace))
+                    self.to_log.emit('<span style=\" color:#1e90ff;\" >Finished trace %s of cycle %s.</span>'
+                                     % (str(trace + 1), str(cycle + 1)))
+                if self.sweep_spacing == 'adaptive':
+                    self.update_voltage_grid()
+                if self.learn_range:
+                    self.update_current_range()
+                if self.abort_event.wait(self.trace_pause):
+                    break
+            if self.abort_event.is_set():
+                self.to_log.emit('<span style=\" color:#ff0000;\" >Scan aborted.</span>')
+                return
             if cycle < self.cycles - 1:
                 self.to_log.emit('<span style=\" color:#ff0000;\" >Next Experiment lined up in %d min.</span>' %
                                  int(self.cycle_pause / 60.))
-                time.sleep(self.cycle_pause)
+                self.abort_event.wait(self.cycle_pause)
             else:
                 self.to_log.emit('<span style=\" color:#32cd32;\" >Finished IV scan.</span>')
+
+    def acquire(self):
+        scpi.apply_settings(self.sourcemeter, self.gpib_port, self.settings())
+        self.reset_clock()
+        self.sourcemeter.write(":OUTP ON;:TRAC:FEED:CONT NEXT;*CLS;:INIT;*OPC")
+        self.wait_for_sweep()
+        self.sourcemeter.write(":OUTP OFF")
+        if self.abort_event.is_set():
+            return self.trace_buffers[:0]
+        return self.read_traces()
+
+    def acquire_until_voc(self):
+        # list sweeps over consecutive chunks of the grid with the output left on, until the points past Voc are in.
+        # The first chunk runs to just past the Voc of the previous trace, so a steady cell needs a single sweep, the
+        # first trace is swept in full. Every further chunk costs a settings update, an *OPC poll and a transfer.
+        sweep_grid, source_list, readings = self.voltage_grid, self.source_list, []
+        n_keep = len(sweep_grid)
+        v_oc, _ = operating_point(self.voltages, self.currents)
+        stop = (len(sweep_grid) if np.isnan(v_oc) else
+                np.searchsorted(sweep_grid, v_oc) + self.early_stop_points + EARLY_STOP_MARGIN)
+        start = 0
+        while start < len(sweep_grid):
+            self.source_list = sweep_grid[start:stop]
+            start, stop = stop, stop + self.early_stop_chunk
+            scpi.apply_settings(self.sourcemeter, self.gpib_port, self.settings())
+            if len(readings) == 0:
+                self.reset_clock()
+            self.sourcemeter.write(":OUTP ON;:TRAC:FEED:CONT NEXT;*CLS;:INIT;*OPC")
+            if not self.wait_for_sweep(len(self.source_list)):
+                break
+            readings.append(self.read_trace_buffer())
+            currents = np.negative(self.get_element(np.concatenate(readings), 'CURR'))
+            crossing = np.flatnonzero((currents[:-1] > 0) & (currents[1:] <= 0))
+            if crossing.size:
+                n_keep = crossing[0] + 1 + self.early_stop_points
+                if len(currents) >= n_keep:
+                    break
+        self.sourcemeter.write(":OUTP OFF")
+        self.source_list = source_list
+        if not readings:
+            return np.zeros((0, len(self.elements)))
+        return np.concatenate(readings)[:n_keep]
+
+    def reset_clock(self):
+        # zero the timestamps of the readings and remember the host time they count from
+        before = time.time()
+        self.sourcemeter.write(":SYST:TIME:RES")
+        self.arm_time = (before + time.time()) / 2.
+
+    def sweep_duration(self, n_points=None):
+        n_points = self.n_data_points if n_points is None else n_points
+        return n_points * (self.trigger_delay + self.averages * (NPLC / LINE_FREQUENCY + POINT_OVERHEAD))
+
+    def acquisition_duration(self, n_points=None):
+        return self.block_traces * self.sweep_duration(n_points) + (self.block_traces - 1) * self.trace_pause
+
+    def wait_for_sweep(self, n_points=None):
+        # serial poll until *OPC flags the end of the sweep, instead of sleeping for a worst case estimate
+        timeout = 2 * self.acquisition_duration(n_points) + 2.0
+        deadline = time.time() + timeout
+        while time.time() < deadline:
+            if self.sourcemeter.read_stb() & EVENT_SUMMARY_BIT:
+                self.sourcemeter.query("*ESR?")
+                return True
+            if self.abort_event.wait(POLL_INTERVAL):
+                return False
+        self.sourcemeter.write(":ABOR")
+        self.to_log.emit('<span style=\" color:#ff0000;\" >Sweep did not complete within %.1f s.</span>' % timeout)
+        return False
+
+    def read_trace_buffer(self):
+        # binary blocks are decoded by pyvisa (np.frombuffer), real32 is widened to float64 as the fits need it
+        datatype = DATA_FORMATS[self.data_format][1]
+        if datatype is None:
+            data = self.sourcemeter.query_ascii_values("TRAC:DATA?", container=np.array)
+        else:
+            data = self.sourcemeter.query_binary_values("TRAC:DATA?", datatype=datatype,
+                                                        is_big_endian=BYTE_ORDERS[self.byte_order][1],
+                                                        container=np.ndarray)
+        return data.reshape(-1, len(self.elements)).astype(float, copy=False)
+
+    def read_traces(self):
+        data = self.read_trace_buffer()
+        if self.block_traces == 1:
+            return data[np.newaxis]
+        n_complete = len(data) // self.n_data_points  # an aborted block only hands out the finished traces
+        return data[:n_complete * self.n_data_points].reshape(n_complete, self.n_data_points, len(self.elements))
+
+    def get_element(self, trace_buffer, element):
+        if element not in self.elements:
+            return np.zeros(len(trace_buffer))
+        return trace_buffer[:, self.elements.index(element)]
+
+    def overflowed(self, trace_buffer):
+        return any(np.any(np.abs(self.get_element(trace_buffer, element)) >= OVERFLOW_VALUE)
+                   for element in ('VOLT', 'CURR'))
+
+    def split_trace(self, trace_buffer):
+        return (self.get_element(trace_buffer, 'VOLT'), np.negative(self.get_element(trace_buffer, 'CURR')),
+                self.get_element(trace_buffer, 'TIME'))
+
+    def stop(self):
+        # returns at once, finished is emitted when the thread has left the instrument in a safe state
         self.is_run = False
-        self.finished.emit()
+        self.abort_event.set()
 
     def close(self):
-        self.is_run = False
+        self.stop()
         if self.gpib_thread is not None:
             self.gpib_thread.join()
-        if not str(self.gpib_port) == 'dummy':
-            self.sourcemeter.write(":ABOR")
-            self.sourcemeter.write("OUTPUT OFF")
-            self.rm.close()
+        else:
+            self.disconnect()
+
+    def disconnect(self):
+        if self.sourcemeter is not None:
+            self.sourcemeter.write(":ABOR;:OUTP OFF")
+            self.sourcemeter.close()
+            self.sourcemeter = None
             self.to_log.emit('<span style=\" color:#000000;\" >Disconnected Keithley...</span>')
+        if self.rm is not None:
+            self.rm.close()
+            self.rm = None
 
-    def get_keithley_data(self):
-        data = pd.DataFrame({
-            'Time (s)': self.times,
-            'Voltage (V)': self.voltages,
-            'Current (A)': self.currents})
-        return data
+    def get_keithley_data(self, trace=None):
+        # the latest trace, its instrument times count from the host time arm_time
+        return IVTrace(self.voltages, self.currents, self.times, mode=self.mode, trace=trace, arm_time=self.arm_time)
 
-    def line_plot(self, target_line=None):
+    def line_plot(self, target_line=None, data=None):
         if target_line is None:
             target_line = pg.PlotCurveItem()
-        if self.gpib_port == 'dummy':
-            xval, yval = [], []
-        elif self.mode == 'isc':
-            xval, yval = list(range(len(self.currents))), self.currents
+        data = self.get_keithley_data() if data is None else data
+        voltages, currents = data.voltage, data.current
+        if self.mode == 'isc':
+            xval, yval = list(range(len(currents))), currents
         else:
-            xval, yval = self.voltages, self.currents
+            xval, yval = voltages, currents
         target_line.setData(xval, yval)
 
     @staticmethod
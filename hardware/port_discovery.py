@@ -0,0 +1,67 @@
+from PyQt5 import QtCore
+import pyvisa as visa
+import threading
+import time
+
+from hardware import serial_ports
+
+CACHE_TIME = 60.  # s
+
+cache = {}  # 'serial' or 'gpib' -> (time of the lookup, ports)
+resource_manager = None
+lookup_lock = threading.Lock()
+
+
+def get_resource_manager():
+    # opening a VISA resource manager is slow, one is kept for all lookups
+    global resource_manager
+    if resource_manager is None:
+        resource_manager = visa.ResourceManager()
+    return resource_manager
+
+
+def close_resource_manager():
+    global resource_manager
+    with lookup_lock:
+        if resource_manager is not None:
+            resource_manager.close()
+            resource_manager = None
+            cache.pop('gpib', None)
+
+
+def get_gpib_ports():
+    return [port for port in get_resource_manager().list_resources('GPIB?*') if port.startswith('GPIB')]
+
+
+def lookup(kind, force=False):
+    # cached list of serial or GPIB ports, looked up again when forced or older than CACHE_TIME
+    with lookup_lock:
+        if not force and kind in cache and time.time() - cache[kind][0] < CACHE_TIME:
+            return cache[kind][1]
+        found = serial_ports.get_serial_ports(probe=True) if kind == 'serial' else get_gpib_ports()
+        cache[kind] = (time.time(), found)
+        return found
+
+
+class PortDiscovery(QtCore.QObject):
+    """ Looks up serial and GPIB ports in a background thread and reports them through signals """
+    serial_ports_found = QtCore.pyqtSignal(list)
+    gpib_ports_found = QtCore.pyqtSignal(list)
+    to_log = QtCore.pyqtSignal(str)
+
+    def refresh_serial(self, force=False):
+        threading.Thread(target=self.background_thread, args=('serial', force), daemon=True).start()
+
+    def refresh_gpib(self, force=False):
+        threading.Thread(target=self.background_thread, args=('gpib', force), daemon=True).start()
+
+    def background_thread(self, kind, force):
+        try:
+            found = lookup(kind, force)
+        except (OSError, ValueError, visa.errors.Error):
+            self.to_log.emit('<span style=\" color:#ff0000;\" >Failed to list %s ports.</span>' % kind.upper())
+            found = []
+        if kind == 'serial':
+            self.serial_ports_found.emit(found)
+        else:
+            self.gpib_ports_found.emit(found)
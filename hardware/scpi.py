@@ -0,0 +1,46 @@
+MAX_MESSAGE_LENGTH = 250
+
+applied_settings = {}  # instrument key -> {header: value} as last written to that instrument
+
+
+def batch(commands, max_length=MAX_MESSAGE_LENGTH):
+    # join commands into as few ';'-separated messages as possible, headers have to be absolute (':' or '*')
+    messages = []
+    for command in commands:
+        if messages and len(messages[-1]) + len(command) + 1 <= max_length:
+            messages[-1] += ';' + command
+        else:
+            messages.append(command)
+    return messages
+
+
+def apply_settings(resource, key, settings, actions=(), reset_command='*RST'):
+    """ Bring an instrument to the given settings, sending only what differs from the last applied state
+
+        :param resource: open pyvisa resource (or anything with a write method)
+        :param key: identifies the instrument across sessions, e.g. its resource name
+        :param settings: (header, value) pairs in the order they have to be sent, None values are not sent and
+            dropped from the remembered state
+        :param actions: commands without state (e.g. clearing buffers) sent before the settings
+        :returns:
+            Number of settings that were written
+    """
+    state = applied_settings.pop(key, None)  # unknown state if writing fails half way
+    reset = state is None
+    state = {} if reset else state
+    commands = []
+    new_state = dict(state)
+    for header, value in settings:
+        if value is None:
+            new_state.pop(header, None)
+        elif state.get(header) != str(value):
+            new_state[header] = str(value)
+            commands.append(f"{header} {value}")
+    for message in batch(([reset_command] if reset else []) + list(actions) + commands):
+        resource.write(message)
+    applied_settings[key] = new_state
+    return len(commands)
+
+
+def forget(key):
+    applied_settings.pop(key, None)
@@ -0,0 +1,290 @@
+import functools
+import numpy as np
+import os
+import pyqtgraph as pg
+from PyQt5 import QtCore
+import threading
+import time
+
+from hardware import arduino
+from utility.decimation import decimate
+from utility.ring_buffer import RingBuffer
+from utility.running_stats import RunningStats
+
+# name, board, analog input, kind
+DEFAULT_CHANNELS = [('power1', 0, 0, 'irradiance'), ('power2', 0, 1, 'irradiance'), ('temp', 0, 2, 'temperature'),
+                    ('power3', 0, 3, 'irradiance')]
+STALE_TIMEOUT = 1.  # s without frames after which a board no longer holds back the merged stream
+DISPLAY_POINTS = 1000
+WINDOW_HOLDBACK = 1.  # s, samples join the sweep statistics once this old, the end of the sweep is known by then
+WINDOW_TIMEOUT = 0.2  # s, longest wait for the samples up to the end of a sweep to arrive
+
+
+def time_window(first, last, history):
+    # copy of the samples from the first to the last time, with one more on either side to interpolate from
+    start, stop = np.searchsorted(history[0], [first, last])
+    return history[:, max(start - 1, 0):stop + 1].copy()
+
+
+def latest_period(period, history):
+    # copy of the samples of the last period before the latest sample
+    start = np.searchsorted(history[0], history[0, -1] - period, side='right') if history.shape[1] else 0
+    return history[:, start:].copy()
+
+
+class SensorHub(QtCore.QObject):
+    """ Runs one Arduino reader per serial port and merges their samples into one time ordered stream
+
+        Channels are addressed by name through the channel map. A merged sample carries the latest value of every
+        channel (sample and hold across boards). Samples are merged once every live board has delivered data up to
+        their time, a board that stops sending is skipped after STALE_TIMEOUT.
+    """
+    update = QtCore.pyqtSignal()
+    to_log = QtCore.pyqtSignal(str)
+    finished = QtCore.pyqtSignal()
+    receiving = QtCore.pyqtSignal()  # from a reader thread, once every board receives values or gave up on them
+
+    def __init__(self, serial_ports=('dummy',), mode='continuous', channels=None, *args, raw_path=None,
+                 decimation='mean', **kwargs):
+        super(SensorHub, self).__init__()
+
+        self.channels = [tuple(channel) for channel in (DEFAULT_CHANNELS if channels is None else channels)]
+        self.names = [name for name, *_ in self.channels]
+        self.mode = mode
+        self.decimation = decimation  # of the plotted history
+        self.init_time = time.time()
+
+        n_boards = max([board for _, board, _, _ in self.channels] + [len(serial_ports) - 1]) + 1
+        ports = list(serial_ports) + ['dummy'] * (n_boards - len(serial_ports))
+        self.boards = []
+        for index, port in enumerate(ports):
+            kinds = {analog_input: kind for _, board, analog_input, kind in self.channels if board == index}
+            board_raw_path = None
+            if raw_path is not None:  # one raw file per board, e.g. Sensor_Raw.bin, Sensor_Raw_1.bin
+                root, extension = os.path.splitext(raw_path)
+                board_raw_path = raw_path if index == 0 else '%s_%d%s' % (root, index, extension)
+            channel_kinds = [kinds.get(i, 'irradiance') for i in range(max(kinds, default=0) + 1)]
+            board = arduino.Arduino(port, mode, *args, **kwargs, raw_path=board_raw_path, channel_kinds=channel_kinds)
+            board.init_time = self.init_time  # common time base of the merged stream
+            board.to_log.connect(self.to_log)
+            board.finished.connect(self.board_finished)
+            board.samples_ready.connect(functools.partial(self.merge, index), QtCore.Qt.DirectConnection)
+            board.receiving.connect(self.board_receiving, QtCore.Qt.DirectConnection)
+            self.boards.append(board)
+        self.boards[0].update.connect(self.update)
+        self.n_running = 0
+        self.n_starting = 0
+        self.query_period = self.boards[0].query_period
+
+        self.lock = threading.Lock()
+        self.pending = [[] for _ in self.boards]
+        self.received_until = [-np.inf for _ in self.boards]
+        self.merged_until = -np.inf
+        self.n_late = [0 for _ in self.boards]
+        self.last_values = np.full(len(self.channels), -1.)
+        self.history = RingBuffer(1 + len(self.channels), sum(board.history_length for board in self.boards))
+
+        self.window_stats = None
+        self.window_stop = None
+        self.window_cursor = None  # time of the last sample folded into window_stats
+        self.window_counts = range(0)  # trace counts of a stopped sweep whose statistics are being completed
+        self.window_finished = threading.Condition(self.lock)
+        # range of trace counts -> [mean, std, min, max] of the sweep that measured them, trace counts not read yet
+        self.window_results = {}
+
+    def read_serial_start(self):
+        # returns at once, receiving is emitted once all boards receive values
+        self.n_running = len(self.boards)
+        with self.lock:
+            self.n_starting = len(self.boards)
+        for board in self.boards:
+            board.read_serial_start()
+
+    def board_receiving(self):
+        # connected with Qt.DirectConnection, runs in the reader thread of the board
+        with self.lock:
+            self.n_starting -= 1
+            started = self.n_starting == 0
+        if started:
+            self.receiving.emit()
+
+    @QtCore.pyqtSlot()
+    def board_finished(self):
+        self.n_running -= 1
+        if self.n_running == 0:
+            self.finished.emit()
+
+    def stop(self):
+        for board in self.boards:
+            board.stop()
+
+    def close(self):
+        self.stop()
+        for board in self.boards:
+            board.close()
+        for line in self.health():
+            self.to_log.emit('<span style=\" color:#000000;\" >Sensor board %s: %d frames, %d dropped, %d late, '
+                             '%d corrupt bytes.</span>' % (line['port'], line['frames'], line['dropped'], line['late'],
+                                                            line['corrupt_bytes']))
+
+    def health(self):
+        return [{'port': str(board.port), 'live': board.is_live(STALE_TIMEOUT), 'frames': board.n_frames,
+                 'dropped': board.n_dropped, 'late': self.n_late[index], 'corrupt_bytes': int(board.n_corrupt_bytes)}
+                for index, board in enumerate(self.boards) if str(board.port) != 'dummy' or board.n_frames]
+
+    def holds_back(self, board):
+        # live boards, and connected boards that have not sent their first frame yet
+        starting = (board.last_frame_time is None and str(board.port) != 'dummy' and
+                    time.time() - self.init_time < arduino.START_TIMEOUT)
+        return board.is_live(STALE_TIMEOUT) or starting
+
+    def merge(self, index, samples):
+        # called from the reader thread of board index
+        with self.lock:
+            late = samples[0] <= self.merged_until
+            self.n_late[index] += int(np.count_nonzero(late))
+            self.pending[index].append(samples[:, ~late])
+            self.received_until[index] = samples[0, -1]
+            watermark = min(self.received_until[i] for i, board in enumerate(self.boards) if self.holds_back(board))
+            chunks = []
+            for i in range(len(self.boards)):
+                if not self.pending[i]:
+                    continue
+                pending = np.concatenate(self.pending[i], axis=1)
+                ready = pending[0] <= watermark
+                self.pending[i] = [pending[:, ~ready]] if not ready.all() else []
+                if ready.any():
+                    chunks.append((i, pending[:, ready]))
+            if chunks:
+                self.extend(chunks)
+
+    def extend(self, chunks):
+        # time order the samples of all boards and fill each channel with its latest value
+        times = np.concatenate([chunk[0] for _, chunk in chunks])
+        values = np.full((len(self.channels), len(times) + 1), np.nan)
+        values[:, 0] = self.last_values
+        offset = 1
+        for board, chunk in chunks:
+            for channel, (_, channel_board, analog_input, _) in enumerate(self.channels):
+                if channel_board == board:
+                    values[channel, offset:offset + chunk.shape[1]] = chunk[1 + analog_input]
+            offset += chunk.shape[1]
+        order = np.concatenate(([0], 1 + np.argsort(times, kind='stable')))
+        values = values[:, order]
+        index = np.where(np.isnan(values), 0, np.arange(values.shape[1]))
+        np.maximum.accumulate(index, axis=1, out=index)
+        values = np.take_along_axis(values, index, axis=1)
+        self.last_values = values[:, -1].copy()
+        times = times[order[1:] - 1]
+        self.history.extend(np.vstack((times, values[:, 1:])))
+        self.merged_until = times[-1]
+        if self.window_stats is not None:
+            self.fold_window(self.merged_until)
+
+    def channel_rows(self, channels=None):
+        # history rows of the named channels, None for names that are not in the channel map
+        names = self.names if channels is None else channels
+        return [1 + self.names.index(name) if name in self.names else None for name in names]
+
+    def fold_window(self, latest):
+        # add the samples since the cursor to the sweep statistics, holding back the recent ones until the end is known
+        until = latest - WINDOW_HOLDBACK if self.window_stop is None else min(latest, self.window_stop)
+        if until > self.window_cursor:
+            history = self.history.view()  # history is only extended under self.lock, which the callers hold
+            first, last = np.searchsorted(history[0], [self.window_cursor, until], side='right')
+            self.window_stats.update(history[1:, first:last])
+            self.window_cursor = until
+        if self.window_stop is not None and latest >= self.window_stop:
+            self.finish_window()
+
+    def finish_window(self):
+        # called under self.lock once the samples up to the end of the sweep are folded in
+        self.window_results[self.window_counts] = [self.window_stats.result(), len(self.window_counts)]
+        self.window_stats = None
+        self.window_counts = range(0)
+        self.window_finished.notify_all()
+
+    @QtCore.pyqtSlot(float)
+    def start_window(self, start_time):
+        # connected with Qt.DirectConnection, runs in the thread of the source meter
+        with self.lock:
+            if self.window_stats is not None and self.window_stop is not None:
+                self.fold_window(self.window_stop)  # previous sweep, samples that are still missing are given up on
+            self.window_stats = RunningStats(len(self.channels))
+            self.window_stop = None
+            self.window_cursor = np.nextafter(start_time - self.init_time, -np.inf)
+
+    @QtCore.pyqtSlot(int, int, float)
+    def stop_window(self, first_count, n_traces, stop_time):
+        # connected with Qt.DirectConnection, returns at once, the window is finished as the samples up to the end of
+        # the sweep are merged, i.e. while the source meter pauses between traces
+        with self.lock:
+            if self.window_stats is None:
+                return
+            self.window_stop = stop_time - self.init_time
+            self.window_counts = range(first_count, first_count + n_traces)
+            live = any(board.is_live(STALE_TIMEOUT) for board in self.boards)
+            self.fold_window(self.merged_until if live else self.window_stop)
+
+    def get_window_statistics(self, count, channels=None, timeout=WINDOW_TIMEOUT):
+        # mean, std, min and max of the channels over the sweep of the given trace count, waits up to timeout for the
+        # samples up to the end of the sweep, blocks, so it is called from the analysis and not from the GUI thread
+        with self.lock:
+            if not self.window_finished.wait_for(lambda: count not in self.window_counts, timeout):
+                self.fold_window(self.window_stop)
+            window = next((window for window in self.window_results if count in window), None)
+            if window is None:
+                result = RunningStats(len(self.channels)).result()
+            else:
+                result = self.window_results[window][0]
+                self.window_results[window][1] -= 1
+                if not self.window_results[window][1]:
+                    del self.window_results[window]
+        return [[values[row - 1] if row else -1. for row in self.channel_rows(channels)] for values in result]
+
+    def interpolate(self, host_times, channels=None):
+        # readings of the channels at the given host times, linear between samples, -1 outside the history
+        times = np.asarray(host_times, dtype=float) - self.init_time
+        rows = self.channel_rows(channels)
+        values = np.full((len(rows), len(times)), -1.)
+        if not len(times):
+            return values
+        history = self.history.read(functools.partial(time_window, times.min(), times.max()))
+        if history.shape[1] < 2:
+            return values
+        index = np.clip(np.searchsorted(history[0], times), 1, history.shape[1] - 1)
+        weight = (times - history[0, index - 1]) / (history[0, index] - history[0, index - 1])
+        inside = (times >= history[0, 0]) & (times <= history[0, -1])
+        for i, row in enumerate(rows):
+            if row:
+                values[i, inside] = (history[row, index - 1] * (1. - weight) + history[row, index] * weight)[inside]
+        return values
+
+    def get_serial_data(self, channel, n_bins=None):
+        # merged history of the named channel, full rate or decimated to n_bins bins
+        row, = self.channel_rows([channel])
+        if row is None:
+            return np.zeros(0), np.zeros(0)
+        if n_bins is not None:
+            # decimated from the history in place, only the bins are copied
+            return self.history.read(lambda history: tuple(np.copy(data) for data in decimate(
+                history[0], history[row], n_bins, self.decimation)))
+        return self.history.read(lambda history: (history[0].copy(), history[row].copy()))
+
+    def line_plot(self, target_line=None, channel=None):
+        if target_line is None:
+            target_line = pg.PlotCurveItem()
+        xval, yval = self.get_serial_data(channel, DISPLAY_POINTS)
+        target_line.setData(xval, yval)
+
+    def get_sensor_latest(self, channels=None):
+        # mean over the last query period, i.e. one decimated bin of the full rate stream
+        rows = self.channel_rows(channels)
+        history = self.history.read(functools.partial(latest_period, self.query_period))
+        if history.shape[1]:
+            sensor_time = float(history[0, -1])
+            sensor_readout = [float(history[row].mean()) if row else -1.0 for row in rows]
+        else:
+            sensor_time = 0.
+            sensor_readout = [-1.0 for _ in rows]
+        return sensor_time, sensor_readout
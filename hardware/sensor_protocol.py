@@ -0,0 +1,82 @@
+import numpy as np
+
+SYNC = b'\xaa\x55'
+SEQUENCE_MODULUS = 2**16
+DEVICE_CLOCK_MODULUS = 2**32  # micros() wraps after ~71 min
+DEVICE_CLOCK_RESOLUTION = 1e-6
+PERIOD_COMMAND = b'P'
+BITS_PER_BYTE = 10  # 8N1: start and stop bit on top of the data bits
+
+
+def frame_dtype(n_channels=4):
+    # packed little endian frame as written by sensor_adc.ino, the checksum covers sequence, time and channels
+    return np.dtype([('sync', 'u1', (len(SYNC),)), ('sequence', '<u2'), ('time', '<u4'),
+                     ('channels', '<i2', (n_channels,)), ('checksum', '<u2')])
+
+
+def period_command(period):
+    # sets the board's sampling period, sent as 'P' followed by the period in microseconds as uint32
+    return PERIOD_COMMAND + np.array([round(period / DEVICE_CLOCK_RESOLUTION)], dtype='<u4').tobytes()
+
+
+def min_period(baud, dtype):
+    # shortest sampling period whose frames still fit through the serial line
+    return BITS_PER_BYTE * dtype.itemsize / baud
+
+
+def checksum(payload):
+    # 16 bit sum of the payload bytes, one row per frame
+    return (payload.astype(np.uint32).sum(axis=-1) % 2**16).astype(np.uint16)
+
+
+def decode_frames(buffer, dtype):
+    """ Decode all complete frames in a chunk of the serial stream
+
+        Frames are located by their sync header and accepted if their checksum matches, so that a chunk starting
+        mid-frame or containing corrupted bytes resynchronises on the next valid frame.
+
+        :param buffer: bytes received so far (bytes or bytearray)
+        :param dtype: structured dtype from frame_dtype
+        :returns:
+            frames: structured array of the valid frames
+            n_consumed: number of leading bytes that can be dropped from the buffer
+            n_skipped: number of bytes dropped that were not part of a valid frame
+    """
+    data = np.frombuffer(buffer, np.uint8)
+    size = dtype.itemsize
+    starts = np.flatnonzero((data[:-1] == SYNC[0]) & (data[1:] == SYNC[1]))
+    starts = starts[starts + size <= len(data)]
+    raw = data[starts[:, np.newaxis] + np.arange(size)]
+    valid = checksum(raw[:, len(SYNC):-2]) == raw[:, -2:].copy().view('<u2')[:, 0]
+    starts = starts[valid]
+    if len(starts) and np.any(np.diff(starts) < size):
+        # a sync pattern inside a valid frame that also passes the checksum, keep the earliest of overlapping frames
+        keep = []
+        end = 0
+        for start in starts:
+            if start >= end:
+                keep.append(start)
+                end = start + size
+        starts = np.array(keep, dtype=starts.dtype)
+    frames = np.frombuffer(data[starts[:, np.newaxis] + np.arange(size)].tobytes(), dtype)
+    # whatever follows the last frame is kept unless it cannot be the start of an incomplete frame
+    end = starts[-1] + size if len(starts) else 0
+    n_consumed = max(end, len(data) - size + 1, 0)
+    n_skipped = n_consumed - size * len(starts)
+    return frames, n_consumed, n_skipped
+
+
+def dropped_frames(sequence, last_sequence=None):
+    # number of frames missing between consecutive sequence numbers, the counter wraps at 16 bits
+    sequence = sequence.astype(np.int64)
+    if last_sequence is not None:
+        sequence = np.concatenate(([last_sequence], sequence))
+    return int(np.sum((np.diff(sequence) - 1) % SEQUENCE_MODULUS))
+
+
+def unwrap_clock(ticks, last_ticks=None):
+    # device timestamps as a monotonic int64 count, continuing from the last unwrapped value
+    ticks = ticks.astype(np.int64)
+    start = ticks[0] if last_ticks is None else last_ticks
+    steps = np.diff(np.concatenate(([start], ticks))) % DEVICE_CLOCK_MODULUS
+    return start + np.cumsum(steps)
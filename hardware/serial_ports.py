@@ -1,32 +1,41 @@
-import sys
-import glob
 import serial
+from serial.tools import list_ports
+import threading
+import time
 
+PROBE_TIMEOUT = 0.2  # s, bounds reads and writes of a probe
+PROBE_DEADLINE = 1.  # s, ports whose open has not returned by then are dropped
 
-def get_serial_ports():
+
+def get_serial_ports(probe=False):
     """ Lists serial port names
 
-        :raises EnvironmentError:
-            On unsupported or unknown platforms
+        Ports are enumerated from the metadata of the operating system, without opening them.
+
+        :param probe: additionally open every port (in parallel) and drop those that are busy, fail to open or do not
+            open within PROBE_DEADLINE (e.g. Bluetooth serial ports on Windows), the list is returned without waiting
+            for such stragglers
         :returns:
             A list of the serial ports available on the system
     """
-    if sys.platform.startswith('win'):
-        ports = ['COM%s' % (i + 1) for i in range(256)]
-    elif sys.platform.startswith('linux') or sys.platform.startswith('cygwin'):
-        # this excludes your current terminal "/dev/tty"
-        ports = glob.glob('/dev/tty[A-Za-z]*')
-    elif sys.platform.startswith('darwin'):
-        ports = glob.glob('/dev/tty.*')
-    else:
-        raise EnvironmentError('Unsupported platform')
+    ports = sorted(port.device for port in list_ports.comports())
+    if not probe or not ports:
+        return ports
+    # daemon threads, so that an open that never returns does not hold up the exit of the application
+    results = {}
+    threads = [threading.Thread(target=probe_port, args=(port, results), daemon=True) for port in ports]
+    for thread in threads:
+        thread.start()
+    deadline = time.time() + PROBE_DEADLINE
+    for thread in threads:
+        thread.join(max(deadline - time.time(), 0.))
+    return [port for port in ports if results.get(port, False)]
+
 
-    result = []
-    for port in ports:
-        try:
-            s = serial.Serial(port)
-            s.close()
-            result.append(port)
-        except (OSError, serial.SerialException):
-            pass
-    return result
+def probe_port(port, results):
+    try:
+        s = serial.Serial(port, timeout=PROBE_TIMEOUT, write_timeout=PROBE_TIMEOUT)
+        s.close()
+        results[port] = True
+    except (OSError, serial.SerialException):
+        results[port] = False
@@ -0,0 +1,245 @@
+import numpy as np
+import time
+
+from utility.diode_model import ZERO_CELSIUS, single_diode_current, thermal_voltage
+
+VOWELS = 'AEIOU'
+ELEMENT_ORDER = ('VOLT', 'CURR', 'RES', 'TIME', 'STAT')
+OVERFLOW_BIT = 1
+COMPLIANCE_BIT = 8
+OVERFLOW_VALUE = 9.9e37
+OPERATION_COMPLETE_BIT = 1
+EVENT_SUMMARY_BIT = 32
+BANDGAP = 1.12  # eV, silicon
+REFERENCE_TEMPERATURE = 25.
+
+
+def short_form(header):
+    # SCPI short form of every node, e.g. ':SENSE:AVERAGE:COUNT' -> 'SENS:AVER:COUN'
+    nodes = []
+    for node in header.upper().strip(':').split(':'):
+        if len(node) > 4:
+            node = node[:3] if node[3] in VOWELS else node[:4]
+        nodes.append(node)
+    return ':'.join(nodes)
+
+
+class SimulatedSourcemeter:
+    """ Stand-in for the pyvisa resource of a Keithley 2400 that measures a single-diode solar cell
+
+        Accepts the SCPI subset sent by Keithley.config_keithley and answers trace buffer queries with
+        simulated readings. Readings become available at the rate of the configured sweep (trigger delay, averages,
+        NPLC), command and transfer latencies are slept so that the host side timing is realistic.
+    """
+
+    def __init__(self, photocurrent=0.1, saturation_current=1e-8, ideality=1.5, n_cells=1, series_resistance=0.5,
+                 shunt_resistance=500., temperature=25., temperature_swing=0.5, drift_period=600.,
+                 current_noise=2e-5, voltage_noise=1e-4, line_frequency=50., reading_overhead=2e-3,
+                 autorange_overhead=1e-3, command_latency=1e-3, transfer_rate=2e5, seed=None):
+        self.photocurrent = photocurrent
+        self.saturation_current = saturation_current
+        self.ideality = ideality
+        self.n_cells = n_cells
+        self.series_resistance = series_resistance
+        self.shunt_resistance = shunt_resistance
+        self.temperature = temperature
+        self.temperature_swing = temperature_swing
+        self.drift_period = drift_period
+        self.current_noise = current_noise
+        self.voltage_noise = voltage_noise
+        self.line_frequency = line_frequency
+        self.reading_overhead = reading_overhead
+        self.autorange_overhead = autorange_overhead  # range search and settling per reading
+        self.command_latency = command_latency
+        self.transfer_rate = transfer_rate  # bytes/s on the bus
+        self.timeout = 2000
+
+        self.rng = np.random.default_rng(seed)
+        self.power_on_time = time.time()
+        self.settings = {}
+        self.output = False
+        self.event_status = 0
+        self.event_enable = 0
+        self.opc_armed = False
+        self.buffer = np.zeros((0, len(ELEMENT_ORDER)))
+        self.reading_times = np.zeros(0)
+        self.reset()
+
+    def reset(self):
+        self.settings = {'SOUR:VOLT:STAR': 0., 'SOUR:VOLT:STOP': 0., 'SOUR:SWE:POIN': 1, 'SOUR:VOLT:MODE': 'FIX',
+                         'SOUR:VOLT': 0., 'SOUR:LIST:VOLT': np.zeros(1), 'TRIG:COUN': 1, 'ARM:COUN': 1, 'ARM:SOUR': 'IMM',
+                         'ARM:TIM': 0.1, 'TRIG:DEL': 0., 'SOUR:DEL': 0.,
+                         'SENS:CURR:PROT': 0.105, 'SENS:CURR:RANG:AUTO': 'ON',
+                         'SENS:CURR:RANG': 1e-4, 'SENS:CURR:NPLC': 1., 'SENS:AVER:COUN': 10,
+                         'SENS:AVER:STAT': 'OFF', 'TRAC:POIN': 100, 'FORM:ELEM': ','.join(ELEMENT_ORDER),
+                         'FORM:DATA': 'ASC', 'FORM:BORD': 'NORM'}
+        self.output = False
+        self.opc_armed = False
+        self.clear_buffer()
+
+    def clear_buffer(self):
+        self.buffer = np.zeros((0, len(ELEMENT_ORDER)))
+        self.reading_times = np.zeros(0)
+
+    # pyvisa resource interface
+
+    def write(self, message):
+        time.sleep(self.command_latency)
+        for command in message.split(';'):
+            if command.strip():
+                self.execute(command.strip())
+
+    def query(self, message):
+        time.sleep(self.command_latency)
+        header = short_form(message.strip().rstrip('?'))
+        if header == '*ESR':
+            self.update_event_status()
+            value, self.event_status = self.event_status, 0
+            return str(value)
+        if header == '*ESE':
+            return str(self.event_enable)
+        if header == '*OPC':
+            self.wait_for_sweep()
+            return '1'
+        if header == '*IDN':
+            return 'KEITHLEY INSTRUMENTS INC.,MODEL 2400,SIMULATED,C30'
+        if header == 'TRAC:POIN:ACT':
+            return str(self.completed_readings())
+        if header == 'TRAC:DATA':
+            message = ','.join('%+.6E' % value for value in self.transfer_block())
+            time.sleep(len(message) / self.transfer_rate)
+            return message
+        return str(self.settings.get(header, ''))
+
+    def query_ascii_values(self, message, container=list):
+        return container([float(value) for value in self.query(message).split(',') if value])
+
+    def query_binary_values(self, message, datatype='f', is_big_endian=False, container=list):
+        time.sleep(self.command_latency)
+        if short_form(message.rstrip('?')) != 'TRAC:DATA':
+            raise ValueError('Binary transfer is only simulated for the trace buffer.')
+        sent = np.dtype(('<' if self.settings['FORM:BORD'] == 'SWAP' else '>') +
+                        ('d' if self.settings['FORM:DATA'] in ('REAL,64', 'DRE') else 'f'))
+        raw = self.transfer_block().astype(sent).tobytes()
+        time.sleep(len(raw) / self.transfer_rate)
+        data = np.frombuffer(raw, ('>' if is_big_endian else '<') + datatype)
+        return data if container in (np.ndarray, np.array) else container(data)
+
+    def read_stb(self):
+        self.update_event_status()
+        return EVENT_SUMMARY_BIT if self.event_status & self.event_enable else 0
+
+    def close(self):
+        pass
+
+    # instrument model
+
+    def execute(self, command):
+        header, _, argument = command.partition(' ')
+        header = short_form(header)
+        argument = argument.strip().strip("'\"")
+        if header == '*RST':
+            self.reset()
+        elif header == '*CLS':
+            self.event_status = 0
+        elif header == '*ESE':
+            self.event_enable = int(argument)
+        elif header == '*OPC':
+            self.opc_armed = True
+        elif header == 'SYST:TIME:RES':
+            self.power_on_time = time.time()
+        elif header == 'INIT':
+            self.initiate()
+        elif header == 'ABOR':
+            self.abort()
+        elif header == 'OUTP':
+            self.output = argument.upper() in ('ON', '1')
+        elif header == 'SENS:CURR:RANG':
+            self.settings[header] = float(argument)
+            self.settings['SENS:CURR:RANG:AUTO'] = 'OFF'
+        elif header == 'SOUR:LIST:VOLT':
+            self.settings[header] = np.array(argument.split(','), dtype=float)
+        elif header == 'SOUR:LIST:VOLT:APP':
+            self.settings['SOUR:LIST:VOLT'] = np.concatenate((self.settings['SOUR:LIST:VOLT'],
+                                                              np.array(argument.split(','), dtype=float)))
+        elif header == 'TRAC:CLE' or (header == 'TRAC:FEED:CONT' and argument.upper() == 'NEXT'):
+            self.clear_buffer()
+        else:
+            try:
+                self.settings[header] = float(argument)
+            except ValueError:
+                self.settings[header] = argument.upper()
+
+    def initiate(self):
+        n_triggers, n_arms = int(self.settings['TRIG:COUN']), int(self.settings['ARM:COUN'])
+        n_readings = n_triggers * n_arms
+        averages = self.settings['SENS:AVER:COUN'] if self.settings['SENS:AVER:STAT'] == 'ON' else 1
+        autorange = self.settings['SENS:CURR:RANG:AUTO'] == 'ON'
+        reading_time = (self.settings['TRIG:DEL'] + self.settings['SOUR:DEL'] + averages *
+                        (self.settings['SENS:CURR:NPLC'] / self.line_frequency + self.reading_overhead +
+                         autorange * self.autorange_overhead))
+        # the arm timer paces the start of each pass, a pass that takes longer delays the next one
+        arm_interval = n_triggers * reading_time
+        if self.settings['ARM:SOUR'] == 'TIM':
+            arm_interval = max(arm_interval, self.settings['ARM:TIM'])
+        start = time.time()
+        times = (start + arm_interval * np.arange(n_arms)[:, np.newaxis] +
+                 reading_time * np.arange(1, n_triggers + 1)).ravel()
+        voltages = np.resize(self.source_voltages(), n_readings)
+        currents = self.cell_current(voltages, times)
+        voltages = voltages + self.rng.normal(0., self.voltage_noise, n_readings)
+        compliance = self.settings['SENS:CURR:PROT']
+        status = np.where(np.abs(currents) >= compliance, COMPLIANCE_BIT, 0)
+        currents = np.clip(currents, -compliance, compliance)
+        if not autorange:
+            overflow = np.abs(currents) > 1.05 * self.settings['SENS:CURR:RANG']
+            status = status | np.where(overflow, OVERFLOW_BIT, 0)
+            currents = np.where(overflow, OVERFLOW_VALUE, currents)
+        readings = np.column_stack((voltages, currents, voltages / np.where(currents == 0., np.inf, currents),
+                                    times - self.power_on_time, status))
+        space = int(self.settings['TRAC:POIN']) - len(self.buffer)
+        self.buffer = np.vstack((self.buffer, readings[:max(space, 0)]))
+        self.reading_times = np.concatenate((self.reading_times, times[:max(space, 0)]))
+
+    def abort(self):
+        done = self.reading_times <= time.time()
+        self.buffer = self.buffer[done]
+        self.reading_times = self.reading_times[done]
+
+    def source_voltages(self):
+        if self.settings['SOUR:VOLT:MODE'] == 'SWE':
+            return np.linspace(self.settings['SOUR:VOLT:STAR'], self.settings['SOUR:VOLT:STOP'],
+                               int(self.settings['SOUR:SWE:POIN']))
+        if self.settings['SOUR:VOLT:MODE'] == 'LIST':
+            return self.settings['SOUR:LIST:VOLT']
+        return np.array([self.settings['SOUR:VOLT']])
+
+    def cell_current(self, voltages, times):
+        # current into the instrument, i.e. the negative of the photocurrent delivered by the cell
+        temperature = self.temperature + self.temperature_swing * np.sin(2 * np.pi * (times - self.power_on_time) /
+                                                                         self.drift_period)
+        t_ratio = (temperature + ZERO_CELSIUS) / (REFERENCE_TEMPERATURE + ZERO_CELSIUS)
+        nvt = self.ideality * self.n_cells * thermal_voltage(temperature)
+        i0 = self.saturation_current * t_ratio ** 3 * np.exp(
+            BANDGAP / thermal_voltage(REFERENCE_TEMPERATURE) * (1. - 1. / t_ratio))
+        iph = self.photocurrent * (1. + 5e-4 * (temperature - REFERENCE_TEMPERATURE))
+        current = single_diode_current(voltages, iph, i0, nvt, self.series_resistance, self.shunt_resistance)
+        return - current + self.rng.normal(0., self.current_noise, len(voltages))
+
+    def completed_readings(self):
+        return int(np.count_nonzero(self.reading_times <= time.time()))
+
+    def wait_for_sweep(self):
+        if len(self.reading_times):
+            time.sleep(max(self.reading_times[-1] - time.time(), 0.))
+
+    def update_event_status(self):
+        if self.opc_armed and (len(self.reading_times) == 0 or self.reading_times[-1] <= time.time()):
+            self.event_status |= OPERATION_COMPLETE_BIT
+            self.opc_armed = False
+
+    def transfer_block(self):
+        readings = self.buffer[:self.completed_readings()]
+        columns = [ELEMENT_ORDER.index(element) for element in ELEMENT_ORDER
+                   if element in self.settings['FORM:ELEM'].split(',')]
+        return readings[:, columns].ravel()
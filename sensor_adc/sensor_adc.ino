@@ -1,9 +1,21 @@
 #include <Wire.h>
-#include <Adafruit_ADS1015.h>
+#include <Adafruit_ADS1X15.h>
 
-Adafruit_ADS1115 ads(0x48);
+Adafruit_ADS1115 ads;
 unsigned long timer = 0;
-long loopTime = 50000;   // microseconds
+long loopTime = 35000;   // microseconds, four single ended conversions take ~34 ms at 128 SPS, ~5 ms at 860 SPS
+long fastLoopTime = 35000;  // shorter loop times switch the ADC to 860 SPS
+uint16_t sequence = 0;
+
+// the host sets the loop time by sending 'P' followed by the period in microseconds (uint32, little endian)
+const byte PERIOD_COMMAND = 'P';
+
+// frame: sync (0xAA 0x55), sequence (uint16), micros at sampling (uint32), 4 x int16 channels,
+// checksum (uint16 sum of the bytes from sequence to the last channel), all little endian
+const byte SYNC0 = 0xAA;
+const byte SYNC1 = 0x55;
+const int N_CHANNELS = 4;
+const int FRAME_SIZE = 2 + 2 + 4 + 2 * N_CHANNELS + 2;
  
 void setup() {
   Serial.begin(38400);
@@ -14,18 +26,36 @@ void setup() {
   // ads.setGain(GAIN_FOUR);       // +/- 1.024V  1 bit = 0.03125mV
   // ads.setGain(GAIN_EIGHT);      +/- 0.512V  1 bit = 0.015625mV
   // ads.setGain(GAIN_SIXTEEN);    +/- 0.256V  1 bit = 0.0078125mV
-  ads.begin();
+  ads.begin(0x48);
+  ads.setDataRate(RATE_ADS1115_128SPS);
     
   timer = micros();
 }
 
 void loop() {
+  readCommand();
   timeSync(loopTime);
-  int16_t val0 = ads.readADC_SingleEnded(0);
-  int16_t val1 = ads.readADC_SingleEnded(1);
-  int16_t val2 = ads.readADC_SingleEnded(2);
-  int16_t val3 = ads.readADC_SingleEnded(3);
-  sendToPC(&val0, &val1, &val2, &val3);
+  uint32_t sampleTime = micros();
+  int16_t values[N_CHANNELS];
+  for (int i = 0; i < N_CHANNELS; i++) {
+    values[i] = ads.readADC_SingleEnded(i);
+  }
+  sendToPC(sampleTime, values);
+}
+
+void readCommand() {
+  if (Serial.available() < 5) {
+    return;
+  }
+  if (Serial.read() != PERIOD_COMMAND) {
+    return;  // out of step, the remaining bytes are dropped one by one on the next loops
+  }
+  unsigned long period = 0;
+  for (int i = 0; i < 4; i++) {
+    period |= (unsigned long)Serial.read() << (8 * i);
+  }
+  loopTime = period;
+  ads.setDataRate(loopTime < fastLoopTime ? RATE_ADS1115_860SPS : RATE_ADS1115_128SPS);
 }
 
 void timeSync(unsigned long deltaT) {
@@ -47,14 +77,26 @@ void timeSync(unsigned long deltaT) {
   timer = currTime + timeToDelay;
 }
  
-void sendToPC(int16_t* data0, int16_t* data1, int16_t* data2, int16_t* data3) {
-  byte* byteData0 = (byte*)(data0);
-  byte* byteData1 = (byte*)(data1);
-  byte* byteData2 = (byte*)(data2);
-  byte* byteData3 = (byte*)(data3);
-  byte buf[8] = {byteData0[0], byteData0[1],
-                  byteData1[0], byteData1[1],
-                  byteData2[0], byteData2[1],
-                  byteData3[0], byteData3[1]};
-  Serial.write(buf, 8);
+void sendToPC(uint32_t sampleTime, int16_t* values) {
+  byte buf[FRAME_SIZE];
+  int n = 0;
+  buf[n++] = SYNC0;
+  buf[n++] = SYNC1;
+  buf[n++] = lowByte(sequence);
+  buf[n++] = highByte(sequence);
+  for (int i = 0; i < 4; i++) {
+    buf[n++] = (sampleTime >> (8 * i)) & 0xFF;
+  }
+  for (int i = 0; i < N_CHANNELS; i++) {
+    buf[n++] = lowByte(values[i]);
+    buf[n++] = highByte(values[i]);
+  }
+  uint16_t checksum = 0;
+  for (int i = 2; i < n; i++) {
+    checksum += buf[i];
+  }
+  buf[n++] = lowByte(checksum);
+  buf[n++] = highByte(checksum);
+  Serial.write(buf, FRAME_SIZE);
+  sequence++;
 }
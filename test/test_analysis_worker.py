@@ -0,0 +1,63 @@
+import threading
+import time
+
+import pytest
+from PyQt5 import QtCore
+
+from utility.analysis_worker import AnalysisWorker
+
+DIRECT = QtCore.Qt.DirectConnection  # no event loop here, signals are received in the emitting thread
+
+
+@pytest.fixture
+def worker():
+    worker = AnalysisWorker(n_threads=4, max_backlog=3)
+    yield worker
+    worker.close()
+
+
+def slow(value, delay):
+    time.sleep(delay)
+    return value
+
+
+def test_results_in_submission_order(worker):
+    results, finished, logs = [], threading.Event(), []
+    worker.result_ready.connect(results.append, DIRECT)
+    worker.finished.connect(finished.set, DIRECT)
+    worker.to_log.connect(logs.append, DIRECT)
+    for value in range(12):
+        worker.submit(slow, value, 0.05 * ((value * 7) % 5))  # later submissions often finish first
+    worker.finish()
+    assert finished.wait(5.)
+    assert results == list(range(12))
+    assert worker.backlog == 0 and worker.wait(0.)
+    assert 'behind' in logs[0] and 'caught up' in logs[-1]
+
+
+def test_a_failed_analysis_is_logged_and_skipped(worker):
+    results, logs = [], []
+    worker.result_ready.connect(results.append, DIRECT)
+    worker.to_log.connect(logs.append, DIRECT)
+    worker.submit(slow, 0, 0.05)
+    worker.submit(lambda: 1 / 0)
+    worker.submit(slow, 2, 0.)
+    assert worker.wait(5.)
+    assert results == [0, 2]
+    assert 'division by zero' in logs[0]
+
+
+def test_run_in_order_runs_one_at_a_time(worker):
+    order = []
+    futures = [worker.run_in_order(lambda value: (time.sleep(0.01 * (5 - value)), order.append(value)), value)
+               for value in range(5)]
+    for future in futures:
+        future.result(5.)
+    assert order == list(range(5))
+
+
+def test_finish_without_pending_analyses(worker):
+    finished = []
+    worker.finished.connect(lambda: finished.append(True), DIRECT)
+    worker.finish()
+    assert finished == [True]
@@ -0,0 +1,88 @@
+import numpy as np
+import pytest
+from scipy.optimize import OptimizeWarning
+import warnings
+
+from utility import batch_curve_pars, curve_pars
+from utility.diode_model import single_diode_current
+from utility.iv_trace import IVTrace
+
+
+def simulated_curves(n_curves=60, seed=0):
+    # noisy single diode curves of different lengths, swept from below 0 V to past Voc like the instrument does
+    rng = np.random.default_rng(seed)
+    curves = []
+    for _ in range(n_curves):
+        parameters = (rng.uniform(0.05, 0.15), 10 ** rng.uniform(-9, -7), 0.026 * rng.uniform(1.2, 1.6),
+                      rng.uniform(0.1, 1.), rng.uniform(200., 2000.))
+        n_points = rng.integers(30, 150)
+        voltages = np.linspace(-0.01, 0.7, n_points)
+        currents = single_diode_current(voltages, *parameters) + rng.normal(0., 2e-5, n_points)
+        curves.append((voltages, currents))
+    return curves
+
+
+def degenerate_curves():
+    # edge cases, most of which the vectorized fits hand on to the single curve functions
+    voltages = np.linspace(-0.01, 0.7, 50)
+    currents = single_diode_current(voltages, 0.1, 1e-8, 0.039, 0.5, 500.)
+    return [(voltages[:2], currents[:2]),  # too short for any fit
+            (np.full(50, 0.3), currents),  # a single voltage
+            (voltages, -np.abs(currents) - 1e-3),  # no positive current
+            (voltages[:20], currents[:20]),  # stops before Voc
+            (np.where(np.arange(50) == 10, np.nan, voltages), currents)]  # a missing reading
+
+
+def single_curve_fit(function, trace, failed):
+    # like batch_curve_pars.fall_back, -1 where the single curve function cannot process the curve
+    try:
+        return function(trace)
+    except (IndexError, TypeError):
+        return failed
+
+
+def single_curve_results(curves):
+    results = []
+    with warnings.catch_warnings():
+        # as set up by curve_pars, pytest resets the filters for every test
+        warnings.simplefilter('error', OptimizeWarning)
+        warnings.simplefilter('ignore', RuntimeWarning)
+        for voltages, currents in curves:
+            trace = IVTrace(voltages, currents)
+            results.append([*single_curve_fit(curve_pars.fit_isc, trace, [-1, -1]),
+                            *single_curve_fit(curve_pars.fit_voc, trace, [-1, -1]),
+                            single_curve_fit(curve_pars.fit_pmax, trace, -1)])
+    return np.array(results, dtype=float)
+
+
+def batch_results(curves):
+    with warnings.catch_warnings():
+        warnings.simplefilter('error', OptimizeWarning)
+        warnings.simplefilter('ignore', RuntimeWarning)
+        return batch_curve_pars.fit_iv_batch(*batch_curve_pars.pad_curves(curves))
+
+
+def test_ragged_curves_match_single_curve_fits():
+    curves = simulated_curves()
+    assert len({len(voltages) for voltages, _ in curves}) > 1
+    batch = batch_results(curves)
+    single = single_curve_results(curves)
+    assert np.all(single != -1)
+    np.testing.assert_allclose(batch[:, :5], single, rtol=1e-5, atol=1e-9)
+    assert np.all(batch[:, 5:] > 0)
+
+
+@pytest.mark.parametrize('curve', range(len(degenerate_curves())))
+def test_fallback_rows_match_single_curve_fits(curve):
+    # the degenerate curve among regular ones, its row goes through the fallback and the others are unaffected
+    curves = simulated_curves(5, seed=1)
+    curves.insert(2, degenerate_curves()[curve])
+    batch = batch_results(curves)
+    single = single_curve_results(curves)
+    np.testing.assert_allclose(batch[:, :5], single, rtol=1e-5, atol=1e-9)
+
+
+def test_padding_must_be_at_the_end():
+    voltages, currents, mask = batch_curve_pars.pad_curves(simulated_curves(2))
+    with pytest.raises(ValueError):
+        batch_curve_pars.fit_iv_batch(voltages, currents, mask[:, ::-1])
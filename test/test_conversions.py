@@ -0,0 +1,26 @@
+import numpy as np
+import pytest
+
+from utility import conversions
+
+CODES = np.array([-32768, -1, 0, 1, 250, 8000, 16000, 27000, 32767], dtype=np.int16)
+
+
+@pytest.mark.parametrize('table_conversion, conversion', [
+    (conversions.voltage_to_power_array, conversions.voltage_to_power),
+    (conversions.voltage_to_temperature_array, conversions.voltage_to_temperature)])
+def test_lookup_table_matches_the_scalar_conversion(table_conversion, conversion):
+    table = conversions.lookup_table(table_conversion, bits=15, adc_range=6.144)
+    with np.errstate(invalid='ignore'):  # codes above the supply voltage have no temperature in either
+        expected = [conversion(conversions.digital_to_voltage(int(code), bits=15, voltage_range=6.144))
+                    for code in CODES]
+    np.testing.assert_allclose(table[CODES.view(np.uint16)], expected, rtol=1e-12)
+
+
+def test_lookup_table_passes_the_supply_voltage():
+    table = conversions.lookup_table(conversions.voltage_to_temperature_array, bits=15, adc_range=6.144,
+                                     voltage_range=5.)
+    code = 16000
+    voltage = conversions.digital_to_voltage(code, bits=15, voltage_range=6.144)
+    assert table[code] == pytest.approx(conversions.voltage_to_temperature(voltage, voltage_range=5.))
+    assert table.shape == (2**16,)
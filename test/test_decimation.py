@@ -0,0 +1,33 @@
+import numpy as np
+import pytest
+
+from utility.decimation import decimate
+
+
+def test_mean_bins_drop_the_oldest_samples():
+    times = np.arange(11.)
+    times_out, values_out = decimate(times, 10 * times, 3, 'mean')
+    np.testing.assert_array_equal(times_out, [3., 6., 9.])  # bins 2-4, 5-7 and 8-10
+    np.testing.assert_array_equal(values_out, [30., 60., 90.])
+
+
+def test_minmax_keeps_the_envelope():
+    times = np.arange(12.)
+    values = np.zeros((2, 12))
+    values[0, 4] = 5.  # spike in the second bin
+    values[1, 10] = -5.  # dip in the third bin
+    times_out, values_out = decimate(times, values, 3, 'minmax')
+    np.testing.assert_array_equal(times_out, [0., 3., 4., 7., 8., 11.])
+    np.testing.assert_array_equal(values_out, [[0., 0., 0., 5., 0., 0.], [0., 0., 0., 0., -5., 0.]])
+
+
+@pytest.mark.parametrize('method, n', [('mean', 5), ('minmax', 10)])
+def test_short_streams_are_returned_as_they_are(method, n):
+    times = np.arange(float(n))
+    times_out, values_out = decimate(times, times, 5, method)
+    assert times_out is times and values_out is times
+
+
+def test_unknown_method():
+    with pytest.raises(ValueError):
+        decimate(np.arange(10.), np.arange(10.), 2, 'median')
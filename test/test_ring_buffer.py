@@ -0,0 +1,44 @@
+import numpy as np
+import pytest
+
+from utility.ring_buffer import RingBuffer
+
+
+def samples(first, n):
+    # time row and one channel, numbered from first
+    times = np.arange(first, first + n, dtype=float)
+    return np.vstack((times, -times))
+
+
+@pytest.mark.parametrize('chunk', [1, 3, 7, 10, 25])
+def test_latest_samples_across_the_wrap(chunk):
+    ring = RingBuffer(2, 10)
+    for first in range(0, 53, chunk):
+        ring.extend(samples(first, chunk))
+        n_written = first + chunk
+        assert len(ring) == min(n_written, 10)
+        np.testing.assert_array_equal(ring.view(), samples(max(n_written - 10, 0), len(ring)))
+        np.testing.assert_array_equal(ring.view(4), samples(n_written - min(4, n_written), min(4, n_written)))
+        np.testing.assert_array_equal(ring.latest(), samples(n_written - 1, 1)[:, 0])
+
+
+def test_view_is_read_only_and_read_copies_under_the_lock():
+    ring = RingBuffer(2, 5)
+    ring.extend(samples(0, 8))
+    with pytest.raises(ValueError):
+        ring.view()[0, 0] = 1.
+    copy = ring.read(np.copy, 3)
+    ring.extend(samples(8, 4))
+    np.testing.assert_array_equal(copy, samples(5, 3))
+    assert ring.read(lambda history: history[0].sum()) == sum(range(7, 12))
+
+
+def test_empty_and_cleared():
+    ring = RingBuffer(2, 5)
+    assert ring.latest() is None
+    assert ring.view().shape == (2, 0)
+    ring.extend(samples(0, 3))
+    ring.clear()
+    assert len(ring) == 0
+    ring.extend(samples(10, 2))
+    np.testing.assert_array_equal(ring.view(), samples(10, 2))
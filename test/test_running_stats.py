@@ -0,0 +1,26 @@
+import numpy as np
+
+from utility.running_stats import RunningStats
+
+
+def test_batches_match_numpy():
+    rng = np.random.default_rng(0)
+    data = rng.normal([[700.], [43.], [1e-3]], [[5.], [0.1], [1e-5]], (3, 1000))
+    stats = RunningStats(3)
+    edges = [0, 1, 2, 50, 51, 400, 999, 1000]
+    for start, stop in zip(edges[:-1], edges[1:]):
+        stats.update(data[:, start:stop])
+    stats.update(data[:, :0])
+    mean, std, minimum, maximum = stats.result()
+    np.testing.assert_allclose(mean, data.mean(axis=1), rtol=1e-12)
+    np.testing.assert_allclose(std, data.std(axis=1, ddof=1), rtol=1e-9)
+    np.testing.assert_array_equal(minimum, data.min(axis=1))
+    np.testing.assert_array_equal(maximum, data.max(axis=1))
+    assert stats.count == 1000
+
+
+def test_no_samples_and_a_single_sample():
+    stats = RunningStats(2)
+    assert stats.result() == [[-1., -1.]] * 4
+    stats.update(np.array([[3.], [4.]]))
+    assert stats.result() == [[3., 4.], [0., 0.], [3., 4.], [3., 4.]]
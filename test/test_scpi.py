@@ -0,0 +1,75 @@
+import pytest
+
+from hardware import scpi
+
+KEY = 'GPIB::24::INSTR'
+SETTINGS = [(':SOUR:FUNC', 'VOLT'), (':SENS:CURR:PROT', 0.5), (':SOUR:VOLT:STAR', -0.01), (':SOUR:VOLT:STOP', 0.7)]
+
+
+class Resource:
+    # records the messages written to it, fails from the given message on
+    def __init__(self, fail_at=None):
+        self.messages = []
+        self.fail_at = fail_at
+
+    def write(self, message):
+        if self.fail_at is not None and len(self.messages) >= self.fail_at:
+            raise OSError('write failed')
+        self.messages.append(message)
+
+    @property
+    def commands(self):
+        return [command for message in self.messages for command in message.split(';')]
+
+
+@pytest.fixture(autouse=True)
+def unknown_state():
+    scpi.forget(KEY)
+    yield
+    scpi.forget(KEY)
+
+
+def test_first_run_resets_and_sends_everything():
+    resource = Resource()
+    assert scpi.apply_settings(resource, KEY, SETTINGS, actions=[':TRAC:CLE']) == len(SETTINGS)
+    assert resource.commands == ['*RST', ':TRAC:CLE', ':SOUR:FUNC VOLT', ':SENS:CURR:PROT 0.5', ':SOUR:VOLT:STAR -0.01',
+                                 ':SOUR:VOLT:STOP 0.7']
+    assert len(resource.messages) == 1
+
+
+def test_rerun_sends_only_the_difference():
+    scpi.apply_settings(Resource(), KEY, SETTINGS)
+    resource = Resource()
+    changed = [(header, 0.8 if header == ':SOUR:VOLT:STOP' else value) for header, value in SETTINGS]
+    assert scpi.apply_settings(resource, KEY, changed, actions=[':TRAC:CLE']) == 1
+    assert resource.commands == [':TRAC:CLE', ':SOUR:VOLT:STOP 0.8']
+
+    resource = Resource()
+    assert scpi.apply_settings(resource, KEY, changed) == 0
+    assert resource.messages == []
+
+
+def test_none_values_are_not_sent_and_sent_again_once_set():
+    scpi.apply_settings(Resource(), KEY, SETTINGS)
+    resource = Resource()
+    scpi.apply_settings(resource, KEY, SETTINGS[:-1] + [(':SOUR:VOLT:STOP', None)])
+    assert resource.messages == []
+    resource = Resource()
+    scpi.apply_settings(resource, KEY, SETTINGS)
+    assert resource.commands == [':SOUR:VOLT:STOP 0.7']
+
+
+def test_failed_write_resets_on_the_next_run():
+    with pytest.raises(OSError):
+        scpi.apply_settings(Resource(fail_at=0), KEY, SETTINGS)
+    resource = Resource()
+    scpi.apply_settings(resource, KEY, SETTINGS)
+    assert resource.commands[0] == '*RST'
+    assert len(resource.commands) == 1 + len(SETTINGS)
+
+
+def test_batches_stay_below_the_message_length():
+    commands = [':SOUR:LIST:VOLT %s' % ','.join(['0.1234'] * 20)] * 5
+    messages = scpi.batch(commands, max_length=300)
+    assert all(len(message) <= 300 for message in messages)
+    assert ';'.join(messages).split(';') == commands
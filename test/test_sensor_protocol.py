@@ -0,0 +1,75 @@
+import numpy as np
+
+from hardware import sensor_protocol
+
+DTYPE = sensor_protocol.frame_dtype(4)
+SIZE = DTYPE.itemsize
+
+
+def encode_frames(sequence, channels=None):
+    # frames as the board writes them, for the given sequence numbers
+    sequence = np.asarray(sequence)
+    frames = np.zeros(len(sequence), DTYPE)
+    frames['sync'] = list(sensor_protocol.SYNC)
+    frames['sequence'] = sequence % sensor_protocol.SEQUENCE_MODULUS
+    frames['time'] = sequence * 1000
+    frames['channels'] = (np.arange(4) + 100 * sequence[:, np.newaxis] if channels is None else channels)
+    raw = frames.view(np.uint8).reshape(len(frames), SIZE)
+    frames['checksum'] = sensor_protocol.checksum(raw[:, len(sensor_protocol.SYNC):-2])
+    return frames.tobytes()
+
+
+def test_clean_stream():
+    frames, n_consumed, n_skipped = sensor_protocol.decode_frames(encode_frames(range(10)), DTYPE)
+    assert frames['sequence'].tolist() == list(range(10))
+    assert frames['channels'][3].tolist() == [300, 301, 302, 303]
+    assert (n_consumed, n_skipped) == (10 * SIZE, 0)
+
+
+def test_incomplete_frames_stay_in_the_buffer():
+    buffer = encode_frames(range(3))
+    frames, n_consumed, n_skipped = sensor_protocol.decode_frames(buffer[5:-4], DTYPE)
+    assert frames['sequence'].tolist() == [1]
+    assert n_consumed == 2 * SIZE - 5
+    assert n_skipped == SIZE - 5
+    frames, *_ = sensor_protocol.decode_frames(buffer[-4 - SIZE:-4] + buffer[-4:], DTYPE)
+    assert frames['sequence'].tolist() == [2]
+
+
+def test_resync_after_a_bad_checksum():
+    buffer = bytearray(encode_frames(range(5)))
+    buffer[2 * SIZE + 6] ^= 0xff  # a channel byte of frame 2
+    frames, n_consumed, n_skipped = sensor_protocol.decode_frames(buffer, DTYPE)
+    assert frames['sequence'].tolist() == [0, 1, 3, 4]
+    assert (n_consumed, n_skipped) == (5 * SIZE, SIZE)
+    assert sensor_protocol.dropped_frames(frames['sequence']) == 1
+
+
+def test_resync_after_bad_sync_bytes():
+    buffer = bytearray(encode_frames(range(5)))
+    buffer[SIZE] = 0  # sync of frame 1
+    buffer = b'\x55\xaa\x01' + bytes(buffer)  # and noise before the first frame
+    frames, n_consumed, n_skipped = sensor_protocol.decode_frames(buffer, DTYPE)
+    assert frames['sequence'].tolist() == [0, 2, 3, 4]
+    assert (n_consumed, n_skipped) == (len(buffer), 3 + SIZE)
+
+
+def test_sync_pattern_inside_a_frame():
+    # channel values that contain the sync bytes do not produce extra frames
+    channels = np.frombuffer(sensor_protocol.SYNC * 4, '<i2')
+    frames, _, n_skipped = sensor_protocol.decode_frames(encode_frames(range(4), channels), DTYPE)
+    assert frames['sequence'].tolist() == [0, 1, 2, 3]
+    assert n_skipped == 0
+
+
+def test_dropped_frames_across_the_sequence_wrap():
+    sequence = np.array([65533, 65534, 1, 2, 5], dtype=np.uint16)
+    assert sensor_protocol.dropped_frames(sequence) == 4  # 65535, 0, 3 and 4
+    assert sensor_protocol.dropped_frames(sequence, last_sequence=65530) == 6
+
+
+def test_clock_unwraps_across_chunks():
+    ticks = np.array([2**32 - 2000, 2**32 - 1000, 0, 1000], dtype=np.uint32)
+    unwrapped = sensor_protocol.unwrap_clock(ticks)
+    assert np.diff(unwrapped).tolist() == [1000, 1000, 1000]
+    assert sensor_protocol.unwrap_clock(np.array([2000], dtype=np.uint32), unwrapped[-1])[0] == unwrapped[-1] + 1000
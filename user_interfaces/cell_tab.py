@@ -1,7 +1,7 @@
 import os
 from PyQt5 import QtWidgets, QtGui, QtCore
-import pyvisa as visa
 
+from hardware.port_discovery import PortDiscovery
 from user_interfaces.widgets.separator import Separator
 from user_interfaces.widgets.switch_button import Switch
 from utility.config import defaults, paths, ports, write_config
@@ -93,12 +93,50 @@ class CellWidget(QtWidgets.QWidget):
         hbox_terminals.addStretch(-1)
         vbox_total.addLayout(hbox_terminals)
 
+        grid_acquisition = QtWidgets.QGridLayout()
+        self.buffered_btn = Switch()
+        self.buffered_btn.setChecked(defaults['acquisition'][0])
+        self.buffered_btn.setToolTip('Acquire all traces of a cycle in one go, the trace pause may be below 1 s')
+        grid_acquisition.addWidget(self.buffered_btn, 0, 0)
+        grid_acquisition.addWidget(QtWidgets.QLabel("Buffered Traces", self), 0, 1)
+        grid_acquisition.addWidget(QtWidgets.QLabel("Spacing", self), 1, 0)
+        self.spacing_cb = QtWidgets.QComboBox()
+        self.spacing_cb.addItems(['linear', 'adaptive'])
+        self.spacing_cb.setCurrentText(defaults['acquisition'][1])
+        self.spacing_cb.setToolTip('Adaptive sweeps concentrate the points around Voc and the maximum power point')
+        grid_acquisition.addWidget(self.spacing_cb, 1, 1)
+        grid_acquisition.addWidget(QtWidgets.QLabel("I Range", self), 2, 0)
+        self.range_cb = QtWidgets.QComboBox()
+        self.range_cb.addItems(['auto', 'learned'])
+        self.range_cb.setCurrentText(defaults['acquisition'][2])
+        self.range_cb.setToolTip('Learned ranging fixes the current range found by the first autoranged trace')
+        grid_acquisition.addWidget(self.range_cb, 2, 1)
+        grid_acquisition.addWidget(QtWidgets.QLabel("Stop past Voc", self), 1, 2)
+        self.early_stop_edit = QtWidgets.QLineEdit('%s' % defaults['acquisition'][3], self)
+        self.early_stop_edit.setFixedWidth(60)
+        self.early_stop_edit.setToolTip('Points measured past Voc before the sweep stops, 0 sweeps the full range')
+        grid_acquisition.addWidget(self.early_stop_edit, 1, 3)
+        grid_acquisition.addWidget(QtWidgets.QLabel("Stop Chunk", self), 2, 2)
+        self.early_stop_chunk_edit = QtWidgets.QLineEdit('%s' % defaults['acquisition'][4], self)
+        self.early_stop_chunk_edit.setFixedWidth(60)
+        self.early_stop_chunk_edit.setToolTip('Points per further sweep, when Voc lies beyond the predicted one')
+        grid_acquisition.addWidget(self.early_stop_chunk_edit, 2, 3)
+        grid_acquisition.setColumnStretch(4, 1)
+        vbox_total.addLayout(grid_acquisition)
+
         hbox_port = QtWidgets.QHBoxLayout()
         hbox_port.addWidget(QtWidgets.QLabel("GPIB Port", self))
         self.source_cb = QtWidgets.QComboBox()
         self.source_cb.setFixedWidth(160)
-        self.get_gpib_ports()
+        self.source_cb.addItem('dummy')
+        if ports['keithley'] != 'dummy':  # until the port lookup is done
+            self.source_cb.addItem(ports['keithley'])
+            self.source_cb.setCurrentText(ports['keithley'])
         self.source_cb.currentTextChanged.connect(self.source_port_changed)
+        self.port_discovery = PortDiscovery()
+        self.port_discovery.gpib_ports_found.connect(self.set_gpib_ports)
+        self.port_discovery.to_log.connect(self.to_log)
+        self.port_discovery.refresh_gpib()
         hbox_port.addWidget(self.source_cb)
         self.refresh_button = QtWidgets.QPushButton(
             QtGui.QIcon(os.path.join(paths['icons'], 'refresh.png')), '')
@@ -212,15 +250,22 @@ class CellWidget(QtWidgets.QWidget):
             pass
 
     def get_gpib_ports(self):
+        self.refresh_button.setDisabled(True)
+        self.port_discovery.refresh_gpib(force=True)
+
+    @QtCore.pyqtSlot(list)
+    def set_gpib_ports(self, found):
+        selected = ports['keithley']
+        self.source_cb.blockSignals(True)
         self.source_cb.clear()
         self.source_cb.addItem('dummy')
-        rm = visa.ResourceManager()
-        for port in rm.list_resources():
-            if port.startswith('GPIB'):
-                self.source_cb.addItem(port)
-            if port == ports['keithley']:
+        for port in found:
+            self.source_cb.addItem(port)
+            if port == selected:
                 self.source_cb.setCurrentText(port)
-        rm.close()
+        self.source_cb.blockSignals(False)
+        self.source_port_changed()
+        self.refresh_button.setDisabled(False)
 
     def source_port_changed(self):
         ports['keithley'] = self.source_cb.currentText()
@@ -238,6 +283,8 @@ class CellWidget(QtWidgets.QWidget):
             int(self.averages_edit.text())
             int(self.traces_edit.text())
             int(self.cycles_edit.text())
+            int(self.early_stop_edit.text())
+            int(self.early_stop_chunk_edit.text())
             float(self.start_edit.text())
             float(self.end_edit.text())
             float(self.ilimit_edit.text())
@@ -252,7 +299,7 @@ class CellWidget(QtWidgets.QWidget):
                 float(self.start_edit.text()) < -0.15,
                 float(self.start_edit.text()) > float(self.end_edit.text()),
                 float(self.trigger_delay_edit.text()) < 0.0,
-                float(self.trace_pause_edit.text()) < 1.0,
+                float(self.trace_pause_edit.text()) < (0.0 if self.buffered_btn.isChecked() else 1.0),
                 float(self.cycle_pause_edit.text()) < 0.5,
                 float(self.ilimit_edit.text()) > 0.5,
                 float(self.ilimit_edit.text()) <= 0.,
@@ -260,7 +307,9 @@ class CellWidget(QtWidgets.QWidget):
                 int(self.vprot_edit.text()) > 200,
                 int(self.vprot_edit.text()) < 5,
                 int(self.traces_edit.text()) < 1,
-                int(self.cycles_edit.text()) < 1
+                int(self.cycles_edit.text()) < 1,
+                int(self.early_stop_edit.text()) < 0,
+                int(self.early_stop_chunk_edit.text()) < 1
                 ]):
             self.to_log.emit('<span style=\" color:#ff0000;\" >Some parameters are out of bounds. '
                              'Please check before starting measurement.</span>')
@@ -274,4 +323,7 @@ class CellWidget(QtWidgets.QWidget):
                             self.trigger_delay_edit.text(), self.traces_edit.text(), self.trace_pause_edit.text(),
                             self.cycles_edit.text(), self.cycle_pause_edit.text(), self.remote_sense_btn.isChecked(),
                             self.rear_terminal_btn.isChecked()]
+        defaults['acquisition'] = [self.buffered_btn.isChecked(), self.spacing_cb.currentText(),
+                                   self.range_cb.currentText(), int(self.early_stop_edit.text()),
+                                   int(self.early_stop_chunk_edit.text())]
         write_config()
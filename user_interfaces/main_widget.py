@@ -8,17 +8,25 @@ import time
 
 import hardware.keithley as keithley
 import hardware.arduino as arduino
+import hardware.sensor_hub as sensor_hub
 from user_interfaces.cell_tab import CellWidget
 from user_interfaces.info_tab import InfoWidget
 from user_interfaces.plots import PlotsWidget
 from user_interfaces.sensor_tab import SensorWidget
-from utility.config import defaults
+from utility.analysis_worker import AnalysisWorker
+from utility.config import defaults, ports
 from utility.data import Data
-from utility.curve_pars import fit_iv, get_isc
+from utility.curve_pars import DiodeFit, fit_iv, get_isc
 
 pg.setConfigOption('background', 'w')
 pg.setConfigOption('foreground', 'k')
 
+# sensor channels shown in the readout, plots and summary, in the order of the summary columns. The layout is fixed,
+# further channels of the channel map are only saved with the IV curves.
+PLOT_CHANNELS = ['power1', 'power2', 'temp', 'power3']
+SENSOR_COLUMNS = {'power1': 'Irradiance 1 (W/m2)', 'power2': 'Irradiance 2 (W/m2)', 'temp': 'Sample Temperature (C)',
+                  'power3': 'Irradiance 3 (W/m2)'}
+
 
 class MainWidget(QtWidgets.QWidget):
 
@@ -26,13 +34,21 @@ class MainWidget(QtWidgets.QWidget):
         super(MainWidget, self).__init__(parent)
         self.info_data = defaults['info']  # update as references to info_tab
         self.data = Data()
+        self.diode_fit = DiodeFit()
         self.save_path = None
+        self.summary_path = None
+
+        # fits and saving of the traces run in background threads
+        self.analysis = AnalysisWorker()
+        self.analysis.result_ready.connect(self.show_trace_results, QtCore.Qt.QueuedConnection)
+        self.analysis.finished.connect(self.save_summary, QtCore.Qt.QueuedConnection)
+        self.analysis.to_log.connect(self.logger)
 
         self.ns = collections.deque(maxlen=25)
         self.isc = collections.deque(maxlen=25)
         self.voc = collections.deque(maxlen=25)
         self.pmax = collections.deque(maxlen=25)
-        self.ais = [collections.deque(maxlen=25) for _ in range(defaults['arduino'][3])]
+        self.ais = [collections.deque(maxlen=25) for _ in PLOT_CHANNELS]
 
         hbox_total = QtWidgets.QHBoxLayout()
 
@@ -87,7 +103,7 @@ class MainWidget(QtWidgets.QWidget):
     def update_sensor(self):
         if not self.sensor_mes:
             return
-        time_val, [d1val, d2val, tval, d3val] = self.sensor_mes.get_sensor_latest()
+        time_val, [d1val, d2val, tval, d3val] = self.sensor_mes.get_sensor_latest(PLOT_CHANNELS)
         self.sensor_tab.temperature_edit.setText("%.2f" % tval)
         self.sensor_tab.diode1_edit.setText("%.1f" % d1val)
         self.sensor_tab.diode2_edit.setText("%.1f" % d2val)
@@ -125,14 +141,29 @@ class MainWidget(QtWidgets.QWidget):
             self.plot_widget.temp_graph.setLabel('bottom', 'Time (s)')
             self.plot_widget.irrad_graph.setLabel('bottom', 'Time (s)')
         # Give warning and run as dummy if parameter error
+        # board 0 is selected on the sensor tab, further boards of the channel map are set in the config file
+        n_boards = max(board for _, board, _, _ in defaults['sensor_channels']) + 1
+        serial_ports = [str(self.sensor_tab.sensor_cb.currentText())] + [ports.get('arduino_%d' % board, 'dummy')
+                                                                          for board in range(1, n_boards)]
         if self.sensor_tab.check_sensor_parameters() is False:
             self.sensor_tab.set_button_text('continuous', False)
             self.sensor_tab.set_button_text('fixed', False)
-            self.sensor_mes = arduino.Arduino("dummy", mode, *defaults['arduino'])
+            self.sensor_mes = sensor_hub.SensorHub(['dummy'] * n_boards, mode, defaults['sensor_channels'],
+                                                   *defaults['arduino'])
+        elif self.sensor_tab.high_rate_btn.isChecked():
+            # full rate data of a cell measurement is kept next to the IV curves
+            raw_path = os.path.join(self.save_path, 'Sensor_Raw.bin') if mode == 'cell_measure' else None
+            self.sensor_mes = sensor_hub.SensorHub(serial_ports, mode, defaults['sensor_channels'],
+                                                   *defaults['arduino'], sample_period=arduino.HIGH_RATE_PERIOD,
+                                                   raw_path=raw_path, decimation='minmax')
         else:
-            self.sensor_mes = arduino.Arduino(str(self.sensor_tab.sensor_cb.currentText()), mode,
-                                              *defaults['arduino'])
+            self.sensor_mes = sensor_hub.SensorHub(serial_ports, mode, defaults['sensor_channels'],
+                                                   *defaults['arduino'])
         self.sensor_register(self.sensor_mes)
+        missing = [name for name in PLOT_CHANNELS if name not in self.sensor_mes.names]
+        if missing:
+            self.logger('<span style=\" color:#ff0000;\" >Sensor channels %s are not in the channel map and read -1.'
+                        '</span>' % ', '.join(missing))
         self.sensor_mes.read_serial_start()
 
     @QtCore.pyqtSlot()
@@ -145,7 +176,7 @@ class MainWidget(QtWidgets.QWidget):
         self.keithley_mes = mes
         self.keithley_mes.trace_finished.connect(self.trace_finished)
         self.keithley_mes.to_log.connect(self.logger)
-        self.keithley_mes.finished.connect(self.stop_keithley)
+        self.keithley_mes.finished.connect(self.keithley_finished)
 
     def start_keithley(self, mode='fixed'):
         # Block attempt to start different measurement
@@ -157,6 +188,11 @@ class MainWidget(QtWidgets.QWidget):
         elif self.cell_tab.button_checked_count() == 0:  # button unclicked manually or by software
             self.stop_keithley()
             return
+        # Previous measurement is still shutting down
+        elif self.keithley_mes or self.analysis.backlog:
+            self.logger('<span style=\" color:#ff0000;\" > Wait for the current measurement to stop.</span>')
+            self.cell_tab.reset_single_button(mode)
+            return
         # Do not start measurement if faulty parameters are set
         elif self.cell_tab.check_iv_parameters() is False:
             self.stop_keithley()
@@ -176,57 +212,101 @@ class MainWidget(QtWidgets.QWidget):
                                               compliance_current=float(self.cell_tab.ilimit_edit.text()),
                                               voltage_protection=int(self.cell_tab.vprot_edit.text()),
                                               remote_sense=self.cell_tab.remote_sense_btn.isChecked(),
-                                              use_rear_terminals=self.cell_tab.rear_terminal_btn.isChecked()
+                                              use_rear_terminals=self.cell_tab.rear_terminal_btn.isChecked(),
+                                              buffered_traces=self.cell_tab.buffered_btn.isChecked(),
+                                              sweep_spacing=self.cell_tab.spacing_cb.currentText(),
+                                              current_range=self.cell_tab.range_cb.currentText(),
+                                              early_stop_points=int(self.cell_tab.early_stop_edit.text()) or None,
+                                              early_stop_chunk=int(self.cell_tab.early_stop_chunk_edit.text())
                                               )
         self.keithley_register(self.keithley_mes)
         self.get_save_path()
         self.reset_results()
+        self.diode_fit.reset()
         self.start_sensor('cell_measure')
+        self.keithley_mes.sweep_started.connect(self.sensor_mes.start_window, QtCore.Qt.DirectConnection)
+        self.keithley_mes.sweep_stopped.connect(self.sensor_mes.stop_window, QtCore.Qt.DirectConnection)
+        self.sensor_mes.receiving.connect(self.sensor_receiving)
         self.cell_tab.set_button_active(mode)
-        self.keithley_mes.read_keithley_start()
 
-    @QtCore.pyqtSlot(int, int)
-    def trace_finished(self, trace_count, cycle_count):
+    @QtCore.pyqtSlot()
+    def sensor_receiving(self):
+        # the sweeps start once the sensor readings come in, the hub of an earlier measurement is ignored
+        if self.sender() is self.sensor_mes and self.keithley_mes and not self.keithley_mes.abort_event.is_set():
+            self.keithley_mes.read_keithley_start()
+
+    @QtCore.pyqtSlot(int, int, object)
+    def trace_finished(self, trace_count, cycle_count, data_iv):
+        # data_iv was taken by the acquisition thread, the source meter may be on its next traces by now
         if not self.keithley_mes:
             return
-        _, sensor_latest = self.sensor_mes.get_sensor_latest()
         timestamp = time.time()
-        if self.keithley_mes.mode != 'isc':
-            self.keithley_mes.line_plot(self.plot_widget.iv_data_line)
-        data_iv = self.keithley_mes.get_keithley_data()
+        mode = self.keithley_mes.mode
+        if mode != 'isc':
+            self.keithley_mes.line_plot(self.plot_widget.iv_data_line, data_iv)
 
         total_count = cycle_count * self.keithley_mes.traces + trace_count
-
-        if self.keithley_mes.mode == 'isc':
+        # the diode fit starts from the parameters of the previous trace, so the traces are fitted in order
+        diode_fit = None if mode == 'isc' else self.analysis.run_in_order(self.diode_fit.fit, data_iv)
+        self.analysis.submit(self.analyse_trace, mode, total_count, cycle_count, timestamp, data_iv, diode_fit,
+                             self.sensor_mes, self.keithley_mes.abort_event, list(defaults['info']),
+                             list(defaults['cell']), self.save_path)
+
+    def analyse_trace(self, mode, total_count, cycle_count, timestamp, data_iv, diode_fit, sensor_mes, abort_event,
+                      info, cell, save_path):
+        # runs in a thread of the analysis worker
+        # sensor mean, std, min and max over the sweep
+        # the sensor samples up to the end of the sweep are waited for, unless the measurement is being stopped
+        timeout = 0. if abort_event.is_set() else sensor_hub.WINDOW_TIMEOUT
+        sensor_latest, *sensor_spread = sensor_mes.get_window_statistics(total_count, PLOT_CHANNELS, timeout)
+        if mode == 'isc':
             pars_iv = get_isc(data_iv)
+            pars_diode = [-1] * 4
         else:
             pars_iv = fit_iv(data_iv)
-        if self.keithley_mes.mode == 'fixed':
-            save_file = open(os.path.join(self.save_path, 'IV_Curve_%s.csv' % str(total_count)), "a+")
+            pars_diode = diode_fit.result()[6:]  # rs, drs, rsh, drsh
+        if mode == 'fixed':
+            # irradiance and temperature at the time of each point
+            sensor_points = sensor_mes.interpolate(data_iv.metadata['arm_time'] + data_iv.time)
+            export = data_iv.to_frame()
+            for name, values in zip(sensor_mes.names, sensor_points):
+                export[SENSOR_COLUMNS.get(name, name)] = values
+            save_file = open(os.path.join(save_path, 'IV_Curve_%s.csv' % str(total_count)), "a+")
             save_file.write(self.save_string(timestamp,
                                              *sensor_latest,
-                                             *defaults['info'],
-                                             *defaults['cell'],
-                                             *pars_iv))
-            data_iv.to_csv(save_file)
+                                             *info,
+                                             *cell,
+                                             *pars_iv,
+                                             *pars_diode))
+            export.to_csv(save_file)
             save_file.close()
+        return total_count, cycle_count, timestamp, pars_iv, pars_diode, sensor_latest, sensor_spread, info
+
+    @QtCore.pyqtSlot(object)
+    def show_trace_results(self, results):
+        total_count, cycle_count, timestamp, pars_iv, pars_diode, sensor_latest, sensor_spread, info = results
         self.cell_tab.update_readout(pars_iv)
         self.update_plots(total_count, pars_iv, *sensor_latest)
-        self.data.add_line(total_count, cycle_count, timestamp, *pars_iv, *sensor_latest, *defaults['info'])
+        self.data.add_line(total_count, cycle_count, timestamp, *pars_iv, *pars_diode, *sensor_latest,
+                           *[value for values in sensor_spread for value in values], *info)
 
     @QtCore.pyqtSlot()
     def stop_keithley(self):
-        # Save summary data
-        if self.data.df.empty:
-            pass
-        elif self.keithley_mes.mode == 'isc':
-            self.data.save(path=os.path.join(self.save_path, "Isc_Summary.xlsx"))
+        # Returns at once, clean up happens in keithley_finished
+        if self.keithley_mes:
+            self.keithley_mes.stop()
+            if self.keithley_mes.gpib_thread is None:  # stopped while waiting for the sensors
+                self.keithley_finished()
         else:
-            self.data.save(path=os.path.join(self.save_path, "IV_Summary.xlsx"))
-        self.data.reset()
+            self.cell_tab.reset_measure_buttons()
 
-        # End Keithley connection
+    @QtCore.pyqtSlot()
+    def keithley_finished(self):
+        # End Keithley connection, summary is saved once the analysis of the last traces is done
         if self.keithley_mes:
+            summary_name = "Isc_Summary.xlsx" if self.keithley_mes.mode == 'isc' else "IV_Summary.xlsx"
+            self.summary_path = os.path.join(self.save_path, summary_name)
+            self.analysis.finish()
             self.keithley_mes.close()
             self.keithley_mes = None
 
@@ -236,6 +316,19 @@ class MainWidget(QtWidgets.QWidget):
         # Stop sensor
         self.stop_sensor()
 
+    def flush_analysis(self):
+        # Hands on what the Keithley thread and the analyses queued for this widget and waits for it, so that the
+        # summary is saved before the analysis pool shuts down
+        QtCore.QCoreApplication.sendPostedEvents(self)
+        self.analysis.wait()
+        QtCore.QCoreApplication.sendPostedEvents(self)
+
+    @QtCore.pyqtSlot()
+    def save_summary(self):
+        if not self.data.df.empty:
+            self.data.save(path=self.summary_path)
+        self.data.reset()
+
     def reset_results(self):
         if self.keithley_mes.mode == 'continuous':
             plot_points = 50
@@ -245,7 +338,7 @@ class MainWidget(QtWidgets.QWidget):
         self.isc = collections.deque(maxlen=plot_points)
         self.voc = collections.deque(maxlen=plot_points)
         self.pmax = collections.deque(maxlen=plot_points)
-        self.ais = [collections.deque(maxlen=plot_points) for _ in range(defaults['arduino'][3])]
+        self.ais = [collections.deque(maxlen=plot_points) for _ in PLOT_CHANNELS]
 
     def update_plots(self, trace_count, fit_data, *args):
         isc, _, voc, _, pmax = fit_data
@@ -274,7 +367,7 @@ class MainWidget(QtWidgets.QWidget):
                 'source_compliance', 'source_voltage_limit', 'source_averages', 'source_trigger_delay',
                 'source_n_traces', 'source_trace_delay', 'source_n_experiments',
                 'source_experiment_delay', 'source_remote_sense', 'source_rear_terminal',
-                'isc', 'disc', 'voc', 'dvoc', 'pmax']
+                'isc', 'disc', 'voc', 'dvoc', 'pmax', 'rs', 'drs', 'rsh', 'drsh']
         return "\n".join([f"# {par}, {arg}" for par, arg in zip(pars, args)]) + "\n"
 
     @QtCore.pyqtSlot()
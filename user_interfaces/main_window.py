@@ -2,6 +2,7 @@ import ctypes
 import os
 from PyQt5 import QtWidgets, QtGui
 
+from hardware import port_discovery
 from user_interfaces.main_widget import MainWidget
 from utility import config
 from utility.version import __version__
@@ -30,8 +31,13 @@ class MainWindow(QtWidgets.QMainWindow):
     def closeEvent(self, *args, **kwargs):
         super(QtWidgets.QMainWindow, self).closeEvent(*args, **kwargs)
 
-        # Disconnect sensor before shutdown
+        # Disconnect source meter and sensor before shutdown
+        if self.main_widget.keithley_mes:
+            self.main_widget.keithley_mes.close()
+        self.main_widget.flush_analysis()
+        self.main_widget.analysis.close()
         self.main_widget.stop_sensor()
+        port_discovery.close_resource_manager()
 
         # Update config ini with current paths
         config.write_config(save_path=str(self.main_widget.cell_tab.save_dir))
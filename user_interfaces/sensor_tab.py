@@ -1,7 +1,7 @@
 import os
 from PyQt5 import QtWidgets, QtGui, QtCore
 
-from hardware import serial_ports
+from hardware.port_discovery import PortDiscovery
 from user_interfaces.widgets.separator import Separator
 from user_interfaces.widgets.switch_button import Switch
 from utility.config import defaults, paths, ports, write_config
@@ -16,6 +16,10 @@ class SensorWidget(QtWidgets.QWidget):
         super(SensorWidget, self).__init__(parent)
 
         self.block_sensor = False
+        self.restart_sensor = False
+        self.port_discovery = PortDiscovery()
+        self.port_discovery.serial_ports_found.connect(self.set_ports)
+        self.port_discovery.to_log.connect(self.to_log)
 
         vbox_total = QtWidgets.QVBoxLayout()
         vbox_total.addWidget(QtWidgets.QLabel("Parameters", self))
@@ -36,6 +40,10 @@ class SensorWidget(QtWidgets.QWidget):
         self.supply_voltage_edit = QtWidgets.QLineEdit('%s' % defaults['arduino'][6], self)
         self.supply_voltage_edit.setFixedWidth(80)
         grid_pars.addWidget(self.supply_voltage_edit, 1, 1)
+        self.high_rate_btn = Switch()
+        self.high_rate_btn.setToolTip('Stream at the full board rate, the plots show decimated data')
+        grid_pars.addWidget(self.high_rate_btn, 1, 2)
+        grid_pars.addWidget(QtWidgets.QLabel("High Rate", self), 1, 3)
         vbox_total.addLayout(grid_pars)
 
         hbox_port = QtWidgets.QHBoxLayout()
@@ -43,11 +51,11 @@ class SensorWidget(QtWidgets.QWidget):
         self.sensor_cb = QtWidgets.QComboBox()
         self.sensor_cb.setFixedWidth(90)
         self.sensor_cb.addItem('dummy')
-        for port in serial_ports.get_serial_ports():
-            self.sensor_cb.addItem(port)
-            if port == ports['arduino']:
-                self.sensor_cb.setCurrentText(port)
+        if ports['arduino'] != 'dummy':  # until the port lookup is done
+            self.sensor_cb.addItem(ports['arduino'])
+            self.sensor_cb.setCurrentText(ports['arduino'])
         self.sensor_cb.currentTextChanged.connect(self.sensor_port_changed)
+        self.port_discovery.refresh_serial()
         hbox_port.addWidget(self.sensor_cb)
         self.refresh_button = QtWidgets.QPushButton(
             QtGui.QIcon(os.path.join(paths['icons'], 'refresh.png')), '')
@@ -129,14 +137,27 @@ class SensorWidget(QtWidgets.QWidget):
             self.start_sensor.emit()
 
     def update_port(self):
+        # returns at once, the sensor is restarted once the ports have been looked up
         self.stop_sensor.emit()
+        self.restart_sensor = True
+        self.refresh_button.setDisabled(True)
+        self.port_discovery.refresh_serial(force=True)
+
+    @QtCore.pyqtSlot(list)
+    def set_ports(self, found):
+        selected = ports['arduino']
         self.block_sensor = True
         self.sensor_cb.clear()
         self.sensor_cb.addItem('dummy')
-        for port in serial_ports.get_serial_ports():
+        for port in found:
             self.sensor_cb.addItem(port)
+            if port == selected:
+                self.sensor_cb.setCurrentText(port)
         self.block_sensor = False
-        self.start_sensor.emit()
+        self.refresh_button.setDisabled(False)
+        if self.restart_sensor:
+            self.restart_sensor = False
+            self.start_sensor.emit()
 
     def check_sensor_parameters(self):
         try:
@@ -0,0 +1,90 @@
+from concurrent.futures import ThreadPoolExecutor
+import functools
+from PyQt5 import QtCore
+import threading
+
+ANALYSIS_THREADS = 2
+MAX_BACKLOG = 5  # traces waiting for their analysis before the measurement is reported to be ahead
+
+
+class AnalysisWorker(QtCore.QObject):
+    """ Runs analyses in a thread pool and hands their results back in the order they were submitted
+
+        Connect result_ready and finished with Qt.QueuedConnection, so that results reach the receiver in order even
+        when an analysis finishes in the thread that submitted it. Steps that carry state from one trace to the next
+        (e.g. the warm start of a fit) go through run_in_order, which runs them one at a time in submission order.
+    """
+    result_ready = QtCore.pyqtSignal(object)
+    to_log = QtCore.pyqtSignal(str)
+    finished = QtCore.pyqtSignal()
+
+    def __init__(self, n_threads=ANALYSIS_THREADS, max_backlog=MAX_BACKLOG):
+        super(AnalysisWorker, self).__init__()
+        self.executor = ThreadPoolExecutor(max_workers=n_threads)
+        self.sequential = ThreadPoolExecutor(max_workers=1)
+        self.max_backlog = max_backlog
+        self.lock = threading.Lock()
+        self.n_submitted = 0
+        self.n_emitted = 0
+        self.done = {}  # sequence number -> future of analyses that wait for earlier ones
+        self.finishing = False
+        self.behind = False
+        self.idle = threading.Event()
+        self.idle.set()
+
+    @property
+    def backlog(self):
+        return self.n_submitted - self.n_emitted
+
+    def submit(self, function, *args):
+        with self.lock:
+            sequence = self.n_submitted
+            self.n_submitted += 1
+            self.finishing = False
+            self.idle.clear()
+            if self.backlog > self.max_backlog and not self.behind:
+                self.behind = True
+                self.to_log.emit('<span style=\" color:#ff0000;\" >Analysis is %d traces behind the measurement.'
+                                 '</span>' % self.backlog)
+        self.executor.submit(function, *args).add_done_callback(functools.partial(self.analysis_done, sequence))
+
+    def run_in_order(self, function, *args):
+        # future of the result, for an analysis submitted afterwards to wait on
+        return self.sequential.submit(function, *args)
+
+    def analysis_done(self, sequence, future):
+        # runs in the pool thread of the analysis
+        with self.lock:
+            self.done[sequence] = future
+            while self.n_emitted in self.done:
+                future = self.done.pop(self.n_emitted)
+                self.n_emitted += 1
+                if future.exception() is not None:
+                    self.to_log.emit('<span style=\" color:#ff0000;\" >Analysis of a trace failed: %s</span>' %
+                                     future.exception())
+                else:
+                    self.result_ready.emit(future.result())
+            if self.behind and self.backlog == 0:
+                self.behind = False
+                self.to_log.emit('<span style=\" color:#000000;\" >Analysis caught up with the measurement.</span>')
+            if self.backlog == 0:
+                self.idle.set()
+            if self.finishing and self.backlog == 0:
+                self.finishing = False
+                self.finished.emit()
+
+    def finish(self):
+        # finished is emitted once the results of all analyses submitted so far are out
+        with self.lock:
+            if self.backlog:
+                self.finishing = True
+                return
+        self.finished.emit()
+
+    def wait(self, timeout=None):
+        # True once the results of all analyses submitted so far are out
+        return self.idle.wait(timeout)
+
+    def close(self):
+        self.executor.shutdown(wait=True)
+        self.sequential.shutdown(wait=True)
@@ -0,0 +1,271 @@
+import numpy as np
+import pandas as pd
+
+from utility import curve_pars
+from utility.diode_model import lambertw_exp
+from utility.iv_trace import IVTrace
+
+COLUMNS = ['isc', 'disc', 'voc', 'dvoc', 'pmax', 'dpmax', 'ff', 'dff']  # mA, mV, mW and fill factor, -1 if failed
+MAX_ITERATIONS = 200
+TOLERANCE = 1.49012e-08  # relative change of the cost and parameters at convergence, as in curve_fit
+
+
+def pad_curves(curves):
+    """ Stack curves of different lengths into padded arrays
+
+        :param curves: sequence of (voltages, currents) pairs
+        :returns:
+            Voltages and currents of shape (n_curves, n_points), padded at the end of each row, and the mask that is
+            True for measured points
+    """
+    lengths = np.array([len(voltages) for voltages, _ in curves], dtype=int)
+    n_points = lengths.max(initial=0)
+    mask = np.arange(n_points) < lengths[:, np.newaxis]
+    voltages, currents = np.zeros(mask.shape), np.zeros(mask.shape)
+    for row, (v, i) in enumerate(curves):
+        voltages[row, :lengths[row]] = v
+        currents[row, :lengths[row]] = i
+    return voltages, currents, mask
+
+
+def read_iv_curves(paths):
+    # voltages, currents and mask of saved IV_Curve_*.csv files
+    curves = []
+    for path in paths:
+        trace = IVTrace.from_frame(pd.read_csv(path, comment='#', index_col=0))
+        curves.append((trace.voltage, trace.current))
+    return pad_curves(curves)
+
+
+def normalized_slice(start, stop, lengths):
+    # start and stop per row like python slicing of each row, negative start counts from the end
+    start = np.where(start < 0, np.maximum(start + lengths, 0), np.minimum(start, lengths))
+    stop = np.minimum(stop, lengths)
+    return start, np.maximum(stop, start)
+
+
+def gather(values, start, stop):
+    # rows values[start:stop] packed to the left of an array as wide as the longest slice, and their mask
+    width = int((stop - start).max(initial=1))
+    index = np.minimum(start[:, np.newaxis] + np.arange(width), max(values.shape[1] - 1, 0))
+    selected = np.arange(width) < (stop - start)[:, np.newaxis]
+    if values.shape[1] == 0:
+        return np.zeros(selected.shape), selected
+    return np.where(selected, np.take_along_axis(values, index, axis=1), 0.), selected
+
+
+def closest_to_zero(values, mask):
+    # position of the first value with the smallest magnitude in each row, -1 for rows without a finite value
+    magnitude = np.where(mask & np.isfinite(values), np.abs(values), np.inf)
+    index = np.argmin(magnitude, axis=1) if magnitude.shape[1] else np.zeros(len(values), dtype=int)
+    found = np.isfinite(np.take_along_axis(magnitude, index[:, np.newaxis], axis=1)[:, 0]) if magnitude.shape[1] \
+        else np.zeros(len(values), dtype=bool)
+    return np.where(found, index, -1)
+
+
+def polynomial_fit_batch(x, y, selected, degree):
+    """ curve_pars.polynomial_fit on every row, with the points outside selected left out
+
+        :returns:
+            Coefficients (n_rows, degree + 1), covariances (n_rows, degree + 1, degree + 1) and a boolean array that is
+            False for degenerate rows, whose results are undefined
+    """
+    p = degree + 1
+    n = selected.sum(axis=1)
+    finite = np.all(np.isfinite(x) & np.isfinite(y) | ~selected, axis=1)
+    x, y = np.where(selected, x, 0.), np.where(selected, y, 0.)
+    x[~np.isfinite(x)], y[~np.isfinite(y)] = 0., 0.
+    design = x[..., np.newaxis] ** np.arange(p) * selected[..., np.newaxis]
+    u, s, vt = np.linalg.svd(design, full_matrices=False)
+    ok = finite & (n > p) & (s[:, -1] > s[:, 0] * np.maximum(n, p) * np.finfo(float).eps)
+    s = np.where(ok[:, np.newaxis], s, 1.)
+    popt = np.einsum('nqp,nq->np', vt, np.einsum('nmq,nm->nq', u, y) / s)
+    residual = y - np.einsum('nmp,np->nm', design, popt)
+    variance = np.einsum('nm,nm->n', residual, residual) / np.maximum(n - p, 1)
+    pcov = np.einsum('nqp,nq,nqr->npr', vt, 1. / s ** 2, vt) * variance[:, np.newaxis, np.newaxis]
+    return popt, pcov, ok
+
+
+def fall_back(function, voltages, currents, lengths, rows, failed=-1):
+    # single curve fit of the given rows, failed where the single curve function cannot process the curve
+    results = []
+    for row in rows:
+        trace = IVTrace(voltages[row, :lengths[row]], currents[row, :lengths[row]])
+        try:
+            results.append(function(trace))
+        except (IndexError, TypeError):
+            results.append(failed)
+    return results
+
+
+def fit_isc_batch(voltages, currents, mask, n_points=3):
+    lengths = mask.sum(axis=1)
+    isc_idx = closest_to_zero(voltages, mask)
+    start, stop = normalized_slice(np.zeros_like(isc_idx), isc_idx + np.maximum(isc_idx, n_points), lengths)
+    x, selected = gather(voltages, start, stop)
+    y, _ = gather(currents, start, stop)
+    popt, pcov, ok = polynomial_fit_batch(x, y, selected, 1)
+    result = np.stack((popt[:, 0] * 1e3, np.sqrt(np.abs(pcov[:, 0, 0])) * 1e3), axis=1)
+    rows = np.flatnonzero(~ok | (isc_idx < 0))
+    for row, fit in zip(rows, fall_back(curve_pars.fit_isc, voltages, currents, lengths, rows, [-1, -1])):
+        result[row] = fit
+    return result
+
+
+def fit_voc_batch(voltages, currents, mask, n_points=5):
+    lengths = mask.sum(axis=1)
+    voc_idx = closest_to_zero(currents, mask)
+    start, stop = normalized_slice(voc_idx - n_points, voc_idx + n_points, lengths)
+    x, selected = gather(currents, start, stop)
+    y, _ = gather(voltages, start, stop)
+    popt, pcov, ok = polynomial_fit_batch(x, y, selected, 2)
+    result = np.stack((popt[:, 0] * 1e3, np.sqrt(np.abs(pcov[:, 0, 0])) * 1e3), axis=1)
+    rows = np.flatnonzero(~ok | (voc_idx < 0))
+    for row, fit in zip(rows, fall_back(curve_pars.fit_voc, voltages, currents, lengths, rows, [-1, -1])):
+        result[row] = fit
+    return result
+
+
+def shockley_jacobian(v, iph, i0, vt):
+    # model current and its derivatives with respect to iph, i0 and vt, parameters as columns broadcast over v
+    exponential = np.exp(v / vt)
+    model = iph - i0 * exponential
+    jacobian = np.stack((np.ones_like(exponential), -exponential, i0 * exponential * v / vt ** 2), axis=-1)
+    return model, jacobian
+
+
+def shockley_fit_batch(v, i, selected, p0):
+    """ Levenberg-Marquardt fit of iph - i0 * exp(v / vt) on every row at once
+
+        The iterations run on iph, log(i0) and 1 / vt, in which the problem is far better conditioned, the minimum is
+        the same as long as i0 and vt are positive.
+
+        :returns:
+            Parameters (n_rows, 3), their covariances scaled like curve_fit does and a boolean array that is False for
+            rows that did not converge or whose covariance could not be estimated
+    """
+    n_rows = len(v)
+    n = selected.sum(axis=1)
+    with np.errstate(over='ignore', invalid='ignore', divide='ignore'):
+        def evaluate(q):
+            exponential = np.exp(q[:, 1, np.newaxis] + q[:, 2, np.newaxis] * v)
+            residual = np.where(selected, i - q[:, 0, np.newaxis] + exponential, 0.)
+            jacobian = np.stack((np.ones_like(v), -exponential, -exponential * v), axis=-1) * selected[..., np.newaxis]
+            cost = np.einsum('nm,nm->n', residual, residual)
+            return np.where(np.isfinite(cost), cost, np.inf), residual, jacobian
+
+        p0 = np.asarray(p0, dtype=float)
+        q = np.stack((p0[:, 0], np.log(p0[:, 1]), 1. / p0[:, 2]), axis=1)
+        damping = np.full(n_rows, 1e-3)
+        converged = np.zeros(n_rows, dtype=bool)
+        cost, residual, jacobian = evaluate(q)
+        for _ in range(MAX_ITERATIONS):
+            active = ~converged & np.isfinite(cost) & (n > 3)
+            if not active.any():
+                break
+            jtj = np.einsum('nmp,nmq->npq', jacobian, jacobian)
+            jtr = np.einsum('nmp,nm->np', jacobian, residual)
+            diagonal = np.maximum(np.diagonal(jtj, axis1=1, axis2=2), np.finfo(float).tiny)
+            lhs = jtj + damping[:, np.newaxis, np.newaxis] * diagonal[:, np.newaxis, :] * np.eye(3)
+            valid = active & np.all(np.isfinite(lhs), axis=(1, 2)) & np.all(np.isfinite(jtr), axis=1)
+            lhs[~valid] = np.eye(3)
+            step = np.linalg.solve(lhs, np.where(valid[:, np.newaxis], jtr, 0.)[..., np.newaxis])[..., 0]
+            new_cost, new_residual, new_jacobian = evaluate(q + step)
+            better = valid & (new_cost <= cost)
+            small_step = np.all(np.abs(step) <= TOLERANCE * (np.abs(q) + TOLERANCE), axis=1)
+            small_gain = cost - new_cost <= TOLERANCE * cost
+            converged |= better & (small_step | small_gain) | valid & (cost == 0)
+            q[better] = q[better] + step[better]
+            cost[better], residual[better] = new_cost[better], new_residual[better]
+            jacobian[better] = new_jacobian[better]
+            damping = np.where(better, damping / 10., np.where(valid, damping * 10., damping))
+            converged |= valid & ~better & (damping > 1e16)
+
+        popt = np.stack((q[:, 0], np.exp(q[:, 1]), 1. / q[:, 2]), axis=1)
+        _, jacobian = shockley_jacobian(v, *[popt[:, k, np.newaxis] for k in range(3)])
+        jacobian = jacobian * selected[..., np.newaxis]
+        jtj = np.einsum('nmp,nmq->npq', jacobian, jacobian)
+        well_posed = converged & (n > 3) & np.all(np.isfinite(popt), axis=1) & np.all(np.isfinite(jtj), axis=(1, 2))
+        jtj[~well_posed] = np.eye(3)
+        # inverted with the columns scaled to unit norm, the parameters differ by orders of magnitude
+        scale = 1. / np.sqrt(np.maximum(np.diagonal(jtj, axis1=1, axis2=2), np.finfo(float).tiny))
+        jtj = jtj * scale[:, :, np.newaxis] * scale[:, np.newaxis, :]
+        well_posed &= np.linalg.cond(jtj) < 1. / np.finfo(float).eps
+        jtj[~well_posed] = np.eye(3)
+        pcov = (np.linalg.inv(jtj) * scale[:, :, np.newaxis] * scale[:, np.newaxis, :] *
+                (cost / np.maximum(n - 3, 1))[:, np.newaxis, np.newaxis])
+    return popt, pcov, well_posed
+
+
+def fit_pmax_batch(voltages, currents, mask, n_points=10, i00=4e-5, vt0=7.5e-2):
+    """ curve_pars.fit_pmax on every row, with the uncertainty of pmax propagated from the fit covariance
+
+        The maximum of v * (iph - i0 * exp(v / vt)) is at vt * (W(e * iph / i0) - 1), W the Lambert W function.
+    """
+    lengths = mask.sum(axis=1)
+    power = voltages * currents
+    positive = mask & (currents > 0)
+    pmax = np.where(positive.any(axis=1), np.max(np.where(positive, power, -np.inf), axis=1, initial=-np.inf), 0.)
+    at_pmax = mask & (power == pmax[:, np.newaxis])
+    pmax_idx = np.where(at_pmax.any(axis=1), np.argmax(at_pmax, axis=1) if at_pmax.shape[1] else 0, -1)
+    start, stop = normalized_slice(pmax_idx - n_points, pmax_idx + n_points, lengths)
+    v, selected = gather(voltages, start, stop)
+    i, _ = gather(currents, start, stop)
+    iph0 = currents[:, 0] if currents.shape[1] else np.zeros(len(currents))
+    p0 = np.stack((iph0, np.full(len(v), i00), np.full(len(v), vt0)), axis=1)
+    popt, pcov, ok = shockley_fit_batch(v, i, selected, p0)
+
+    iph, i0, vt = popt.T
+    ok &= np.all(~mask | np.isfinite(voltages) & np.isfinite(currents), axis=1)
+    ok &= (pmax_idx >= 0) & (iph > 0) & (i0 > 0) & (vt > 0)
+    with np.errstate(divide='ignore', invalid='ignore', over='ignore'):
+        voltage_pmax = vt * (lambertw_exp(1. + np.log(iph / i0)) - 1.)
+        exponential = np.exp(voltage_pmax / vt)
+        # the derivative of the power with respect to the voltage is zero at the maximum
+        gradient = voltage_pmax[:, np.newaxis] * np.stack((np.ones_like(vt), -exponential,
+                                                           i0 * exponential * voltage_pmax / vt ** 2), axis=1)
+        result = np.stack((voltage_pmax * (iph - i0 * exponential) * 1e3,
+                           np.sqrt(np.abs(np.einsum('np,npq,nq->n', gradient, pcov, gradient))) * 1e3), axis=1)
+    ok &= np.all(np.isfinite(result), axis=1)
+    rows = np.flatnonzero(~ok)
+    for row, fit in zip(rows, fall_back(curve_pars.fit_pmax, voltages, currents, lengths, rows)):
+        result[row] = [fit, -1]
+    return result
+
+
+def fit_iv_batch(voltages, currents, mask=None):
+    """ Isc, Voc, Pmax, the fill factor and their uncertainties of many curves at once
+
+        Gives the numbers of curve_pars.fit_iv within the convergence tolerance of curve_fit. Curves for which the
+        vectorized fits are degenerate or do not converge are handed to the single curve functions, the uncertainty
+        of pmax is -1 for those. A pmax fit that curve_fit gives up on after its maximum number of evaluations can
+        still converge here.
+
+        :param voltages: array (n_curves, n_points)
+        :param currents: array (n_curves, n_points)
+        :param mask: True for measured points, the points of each curve first and padding at the end of the rows
+        :returns:
+            Array (n_curves, len(COLUMNS))
+    """
+    voltages = np.atleast_2d(np.asarray(voltages, dtype=float))
+    currents = np.atleast_2d(np.asarray(currents, dtype=float))
+    mask = np.ones(voltages.shape, dtype=bool) if mask is None else np.asarray(mask, dtype=bool)
+    if np.any(mask[:, 1:] & ~mask[:, :-1]):
+        raise ValueError('Padding must be at the end of each curve.')
+    if len(voltages) == 0:
+        return np.zeros((0, len(COLUMNS)))
+
+    isc = fit_isc_batch(voltages, currents, mask)
+    voc = fit_voc_batch(voltages, currents, mask)
+    pmax = fit_pmax_batch(voltages, currents, mask)
+
+    values = np.stack((isc[:, 0], voc[:, 0], pmax[:, 0]), axis=1)
+    errors = np.stack((isc[:, 1], voc[:, 1], pmax[:, 1]), axis=1)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        ff = pmax[:, 0] * 1e3 / (isc[:, 0] * voc[:, 0])
+        # relative errors added in quadrature, the three fits are taken as independent
+        dff = np.abs(ff) * np.sqrt(np.sum((errors / values) ** 2, axis=1))
+    valid = np.all(values != -1, axis=1) & np.isfinite(ff)
+    ff = np.where(valid, ff, -1.)
+    dff = np.where(valid & np.all(errors != -1, axis=1) & np.isfinite(dff), dff, -1.)
+    return np.column_stack((isc, voc, pmax, ff, dff))
@@ -12,7 +12,15 @@ global_confs = {'progname': 'Lambda IV',
 defaults = {'info': ['N/A', datetime.date.today(), 'unknown', 'unknown', 25.0, 'Vinery Way',
                      datetime.date(1970, 1, 1), -1, 8, 209, 38, 0.46, 0.1, 0.1, 25, -1, -1],
             'cell': [-0.01, 0.7, 0.005, 142, 0.5, 20, 5, 0.0, 5, 5.0, 1, 30.0, False, False],
-            'arduino': [38400, 100, 2, 4, 0.25, 60., 5.2]}
+            'arduino': [38400, 100, 2, 4, 0.25, 60., 5.2],
+            # buffered traces, sweep spacing ('linear' or 'adaptive'), current range ('auto' or 'learned'),
+            # points kept past Voc before the sweep stops (0 sweeps the full range), points per further sweep chunk
+            'acquisition': [False, 'linear', 'auto', 0, 10],
+            # sensor channel name, board (0 is the port on the sensor tab, n > 0 the port 'arduino_n'), input, kind
+            # ('irradiance', 'temperature' or 'voltage'). The readout, plots and summary show power1, power2, temp and
+            # power3, further channels are only saved with the IV curves.
+            'sensor_channels': [['power1', 0, 0, 'irradiance'], ['power2', 0, 1, 'irradiance'],
+                                ['temp', 0, 2, 'temperature'], ['power3', 0, 3, 'irradiance']]}
 
 paths = {'icons': os.path.join(PROJECT_PATH, 'icons'),
          'last_save': PROJECT_PATH}
@@ -48,15 +56,15 @@ def write_config(**kwargs):
 
     config['defaults'] = {'info': defaults['info'],
                           'cell': defaults['cell'],
-                          'arduino': defaults['arduino']}
+                          'arduino': defaults['arduino'],
+                          'acquisition': defaults['acquisition'],
+                          'sensor_channels': defaults['sensor_channels']}
 
     config['paths'] = {'icons': os.path.join(PROJECT_PATH, 'icons'),
                        'last_save': kwargs.get('save_path', paths['last_save'])
                        }
 
-    config['ports'] = {'arduino': kwargs.get('arduino', ports['arduino']),
-                       'keithley': kwargs.get('keithley', ports['keithley'])
-                       }
+    config['ports'] = {key: kwargs.get(key, port) for key, port in ports.items()}
 
     with open(config_path, 'w') as f:
         config.write(f)
@@ -32,3 +32,30 @@ def voltage_to_power(voltage=0):
         return (slope * (voltage / resistor) + offset)*1e3
     else:
         return -1
+
+
+def voltage_to_temperature_array(voltage, voltage_range=5.2):
+    # voltage_to_temperature for arrays, -1 where the voltage is not positive or equals the supply voltage
+    serial_resistance = 56
+    voltage = np.asarray(voltage, dtype=float)
+    temperature = np.full(voltage.shape, -1.)
+    valid = (voltage > 0) & (voltage != voltage_range)
+    with np.errstate(invalid='ignore'):
+        resistance = voltage[valid] * serial_resistance / (voltage_range - voltage[valid])
+        temperature[valid] = - 21.39443 * np.log(resistance) + 123.62807
+    return temperature
+
+
+def voltage_to_power_array(voltage):
+    # voltage_to_power for arrays, -1 where the voltage is negative
+    resistor = 390
+    offset = 0.00004
+    slope = 185
+    voltage = np.asarray(voltage, dtype=float)
+    return np.where(voltage >= 0, (slope * (voltage / resistor) + offset) * 1e3, -1.)
+
+
+def lookup_table(conversion, bits=15, adc_range=6.144, **kwargs):
+    # conversion evaluated for every signed 16 bit code, to be indexed with the codes viewed as uint16
+    codes = np.arange(2**16, dtype=np.uint16).view(np.int16)
+    return conversion(digital_to_voltage(codes.astype(float), bits=bits, voltage_range=adc_range), **kwargs)
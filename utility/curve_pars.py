@@ -3,71 +3,227 @@ from scipy import optimize
 from scipy.optimize import OptimizeWarning
 import warnings
 
+from utility.diode_model import single_diode_current, single_diode_jacobian, thermal_voltage
+from utility.iv_trace import as_trace
+
 warnings.simplefilter("error", OptimizeWarning)
 
+DIODE_PARAMETERS = ('iph', 'i0', 'nvt', 'rs', 'rsh')  # A, A, V, Ohm, Ohm
+
 
-def get_isc(df):
-    isc = df['Current (A)'].mean()
-    disc = df['Current (A)'].std() if df.size > 1 else 0
+def get_isc(trace):
+    currents = as_trace(trace).current
+    isc = np.nanmean(currents)
+    disc = np.nanstd(currents, ddof=1) if len(currents) > 1 else 0
     return [isc * 1e3, disc * 1e3, 0, 0, 0]
 
 
-def fit_iv(df):
+def operating_point(voltages, currents):
+    # rough open-circuit and maximum power voltages of a trace, nan if they are outside the swept range
+    voltages, currents = np.asarray(voltages, dtype=float), np.asarray(currents, dtype=float)
+    crossing = np.flatnonzero((currents[:-1] > 0) & (currents[1:] <= 0))
+    if crossing.size:
+        i = crossing[0]
+        v_oc = voltages[i] + currents[i] * (voltages[i + 1] - voltages[i]) / (currents[i] - currents[i + 1])
+    else:
+        v_oc = np.nan
+    power = np.where(currents > 0, voltages * currents, -np.inf)
+    v_mpp = voltages[np.argmax(power)] if np.any(currents > 0) else np.nan
+    return v_oc, v_mpp
+
+
+def fit_iv(trace):
+    trace = as_trace(trace)
 
-    isc, disc = fit_isc(df)
-    voc, dvoc = fit_voc(df)
-    pmax = fit_pmax(df)
+    isc, disc = fit_isc(trace)
+    voc, dvoc = fit_voc(trace)
+    pmax = fit_pmax(trace)
 
     return [isc, disc, voc, dvoc, pmax]
 
 
-def fit_isc(df, n_points=3, m0=-1e-2):
-    isc_idx = df.index[df['Voltage (V)'].abs() == df['Voltage (V)'].abs().min()][0]
-    slice_df = df[0:isc_idx + max(isc_idx, n_points)]
+def polynomial_fit(x, y, degree):
+    """ Unweighted least squares fit of a polynomial, solved directly as the problem is linear in its coefficients
+
+        :returns:
+            Coefficients in increasing order and their covariance, scaled by the residual variance like curve_fit
+            does, or None if the input is degenerate (too few or non-finite points, collinear design matrix)
+    """
+    x, y = np.asarray(x, dtype=float), np.asarray(y, dtype=float)
+    design = np.vander(x, degree + 1, increasing=True)
+    n, p = design.shape
+    if n <= p or not (np.all(np.isfinite(design)) and np.all(np.isfinite(y))):
+        return None
+    u, s, vt = np.linalg.svd(design, full_matrices=False)
+    if s[-1] <= s[0] * max(n, p) * np.finfo(float).eps:
+        return None
+    popt = vt.T @ ((u.T @ y) / s)
+    residual = y - design @ popt
+    pcov = (vt.T / s ** 2) @ vt * (residual @ residual / (n - p))
+    return popt, pcov
+
+
+def closest_to_zero(values):
+    # position of the first value with the smallest magnitude, ignoring nan
+    magnitude = np.abs(values)
+    return np.flatnonzero(magnitude == magnitude[~np.isnan(magnitude)].min(initial=np.inf))[0]
+
+
+def fit_isc(trace, n_points=3, m0=-1e-2):
+    trace = as_trace(trace)
+    voltages, currents = trace.voltage, trace.current
+    isc_idx = closest_to_zero(voltages)
+    stop = isc_idx + max(isc_idx, n_points)
+
+    fit = polynomial_fit(voltages[0:stop], currents[0:stop], 1)
+    if fit is not None:
+        popt, pcov = fit
+        return [popt[0] * 1e3, np.sqrt(pcov[0, 0]) * 1e3]
 
     try:
         popt, pcov = optimize.curve_fit(lambda x, y0, m: y0 + m * x,
-                                        slice_df['Voltage (V)'],
-                                        slice_df['Current (A)'],
-                                        p0=np.array([slice_df['Current (A)'][0], m0]))
+                                        voltages[0:stop],
+                                        currents[0:stop],
+                                        p0=np.array([currents[0], m0]))
     except (OptimizeWarning, ValueError, RuntimeError):
         return [-1, -1]
     return [popt[0] * 1e3, np.sqrt(np.diag(pcov))[0] * 1e3]
 
 
-def fit_voc(df, n_points=5, y00=1, a0=1, b0=1):
-    voc_idx = df.index[df['Current (A)'].abs() == df['Current (A)'].abs().min()][0]
-    slice_df = df[voc_idx - n_points:voc_idx + n_points]
+def fit_voc(trace, n_points=5, y00=1, a0=1, b0=1):
+    trace = as_trace(trace)
+    voltages, currents = trace.voltage, trace.current
+    voc_idx = closest_to_zero(currents)
+    start, stop = voc_idx - n_points, voc_idx + n_points
+
+    fit = polynomial_fit(currents[start:stop], voltages[start:stop], 2)
+    if fit is not None:
+        popt, pcov = fit
+        return [popt[0] * 1e3, np.sqrt(pcov[0, 0]) * 1e3]
 
     try:
         popt, pcov = optimize.curve_fit(lambda x, y0, a, b: y0 + a * x + b * x ** 2,
-                                        slice_df['Current (A)'],
-                                        slice_df['Voltage (V)'],
+                                        currents[start:stop],
+                                        voltages[start:stop],
                                         p0=np.array([y00, a0, b0]))
     except (OptimizeWarning, ValueError, RuntimeError):
         return [-1, -1]
     return [popt[0] * 1e3, np.sqrt(np.diag(pcov))[0] * 1e3]
 
 
-def fit_pmax(df, n_points=10, i00=4e-5, vt0=7.5e-2):
-    df['Power (W)'] = df['Current (A)'] * df['Voltage (V)']
-    if any(df['Current (A)'] > 0):
-        pmax = df.loc[df['Current (A)'] > 0]['Power (W)'].max()
+def fit_pmax(trace, n_points=10, i00=4e-5, vt0=7.5e-2):
+    trace = as_trace(trace)
+    voltages, currents = trace.voltage, trace.current
+    power = voltages * currents
+    positive = currents > 0
+    if positive.any():
+        pmax = np.nanmax(power[positive])
     else:
         pmax = 0
 
-    pmax_idx = df.index[df['Power (W)'] == pmax][0]
-    slice_df = df[pmax_idx - n_points:pmax_idx + n_points]
+    pmax_idx = np.flatnonzero(power == pmax)[0]
+    start, stop = pmax_idx - n_points, pmax_idx + n_points
 
     def shockley(v, iph, i0, vt):
         return iph - i0 * np.exp(v / vt)
 
     try:
         popt, pcov = optimize.curve_fit(shockley,
-                                        slice_df['Voltage (V)'],
-                                        slice_df['Current (A)'],
-                                        p0=np.array([df['Current (A)'][0], i00, vt0]))
+                                        voltages[start:stop],
+                                        currents[start:stop],
+                                        p0=np.array([currents[0], i00, vt0]))
         voltage_pmax = optimize.minimize_scalar(lambda v: - v * shockley(v, *popt)).x
     except (OptimizeWarning, ValueError, RuntimeError):
         return -1
     return voltage_pmax * shockley(voltage_pmax, *popt) * 1e3
+
+
+def diode_guess(voltages, currents, ideality=1.5):
+    # rough single diode parameters of a trace to start a fit from
+    v_oc, _ = operating_point(voltages, currents)
+    if np.isnan(v_oc):
+        v_oc = np.max(voltages)
+    iph = currents[closest_to_zero(voltages)]
+    nvt = ideality * thermal_voltage()
+    near_isc = voltages <= voltages.min() + 0.2 * (v_oc - voltages.min())
+    fit = polynomial_fit(voltages[near_isc], currents[near_isc], 1)
+    rsh = -1. / fit[0][1] if fit is not None and fit[0][1] < 0 else 1e4
+    i0 = max(iph - v_oc / rsh, 1e-3 * iph) / np.expm1(v_oc / nvt)
+    near_voc = np.argsort(np.abs(currents))[:4]
+    fit = polynomial_fit(currents[near_voc], voltages[near_voc], 1)
+    rs = -fit[0][1] - nvt / (iph + i0) if fit is not None else 0.
+    return np.array([iph, i0, nvt, max(rs, 1e-3), rsh])
+
+
+def fit_single_diode(trace, p0=None):
+    """ Least squares fit of the explicit single diode model to a whole trace
+
+        Iph is fitted directly, I0, n*Vt, Rs and Rsh through their logarithms so that they stay positive. The Jacobian
+        is analytic.
+
+        :param p0: starting parameters in the order of DIODE_PARAMETERS, guessed from the trace if None
+        :returns:
+            Parameters and their standard errors (arrays in the order of DIODE_PARAMETERS), None if the fit fails
+    """
+    trace = as_trace(trace)
+    finite = np.isfinite(trace.voltage) & np.isfinite(trace.current)
+    voltages, currents = trace.voltage[finite], trace.current[finite]
+    n, p = len(voltages), len(DIODE_PARAMETERS)
+    if n <= p:
+        return None
+
+    def parameters(x):
+        return np.concatenate((x[:1], np.exp(x[1:])))
+
+    def residuals(x):
+        return single_diode_current(voltages, *parameters(x)) - currents
+
+    def jacobian(x):
+        popt = parameters(x)
+        jac = single_diode_jacobian(voltages, single_diode_current(voltages, *popt), *popt)
+        jac[:, 1:] *= popt[1:]
+        return jac
+
+    with np.errstate(over='ignore', invalid='ignore', divide='ignore'):
+        try:
+            p0 = diode_guess(voltages, currents) if p0 is None else np.asarray(p0, dtype=float)
+            result = optimize.least_squares(residuals, np.concatenate((p0[:1], np.log(p0[1:]))), jac=jacobian,
+                                            method='lm', x_scale='jac')
+        except (ValueError, IndexError, np.linalg.LinAlgError):
+            return None
+    if not result.success or not np.all(np.isfinite(result.x)) or not np.all(np.isfinite(result.jac)):
+        return None
+    _, s, vt = np.linalg.svd(result.jac, full_matrices=False)
+    if s[-1] <= s[0] * n * np.finfo(float).eps:
+        return None
+    pcov = (vt.T / s ** 2) @ vt * (result.fun @ result.fun / (n - p))
+    popt = parameters(result.x)
+    # standard errors of the logarithms are relative errors
+    return popt, np.sqrt(np.diag(pcov)) * np.concatenate(([1.], popt[1:]))
+
+
+class DiodeFit:
+    """ Single diode fits of the successive traces of one cell
+
+        Each fit starts from the parameters of the last successful one, traces of the same cell differ only slightly so
+        that this converges in a few iterations. If it fails the fit is repeated from a guess.
+    """
+
+    def __init__(self, warm_start=True):
+        self.warm_start = warm_start
+        self.parameters = None
+
+    def fit(self, trace):
+        # parameter, error pairs in the order of DIODE_PARAMETERS, -1 if the fit failed
+        result = None
+        if self.warm_start and self.parameters is not None:
+            result = fit_single_diode(trace, self.parameters)
+        if result is None:
+            result = fit_single_diode(trace)
+        if result is None:
+            return [-1] * 2 * len(DIODE_PARAMETERS)
+        self.parameters = result[0]
+        return [value for pair in zip(*result) for value in pair]
+
+    def reset(self):
+        self.parameters = None
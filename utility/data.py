@@ -4,7 +4,11 @@ import pandas as pd
 class Data:
     def __init__(self):
         self.df = pd.DataFrame(columns=['count', 'cycle', 'timestamp', 'isc_fit', 'disc_fit', 'voc_fit', 'dvoc_fit',
-                                        'pmax_fit', 'irrad1', 'irrad2', 't_sample', 'irrad3', 'name', 'date', 'film_id',
+                                        'pmax_fit', 'rs_fit', 'drs_fit', 'rsh_fit', 'drsh_fit', 'irrad1', 'irrad2',
+                                        't_sample', 'irrad3',
+                                        *[f'{sensor}_{stat}' for stat in ('std', 'min', 'max')
+                                          for sensor in ('irrad1', 'irrad2', 't_sample', 'irrad3')],
+                                        'name', 'date', 'film_id',
                                         'cell_id', 'ref_cell_temp', 'location', 'cal_date', 'cal_value', 'pid_pb',
                                         'pid_int', 'pid_der', 'pid_fuoc', 'pid_tcr1', 'pid_tcr2', 'pid_sp', 't_room',
                                         'rh_room'])
@@ -0,0 +1,31 @@
+import numpy as np
+
+DECIMATION_METHODS = ('mean', 'minmax')
+
+
+def decimate(times, values, n_bins, method='mean'):
+    """ Reduce a stream of samples to at most n_bins bins
+
+        :param times: 1D array of sample times
+        :param values: array with the samples along the last axis (one or more channels)
+        :param n_bins: number of bins to reduce to, the oldest samples that do not fill a bin are dropped
+        :param method: 'mean' gives one point per bin, 'minmax' two points per bin (at the bin start and end times)
+            that keep the envelope of fast transients
+        :returns:
+            Decimated times and values, the inputs themselves if they are already short enough
+    """
+    if method not in DECIMATION_METHODS:
+        raise ValueError('Unknown decimation method %s.' % method)
+    n = times.shape[-1]
+    points_per_bin = 2 if method == 'minmax' else 1
+    if n <= n_bins * points_per_bin:
+        return times, values
+    bin_size = n // n_bins
+    first = n - n_bins * bin_size
+    time_bins = times[first:].reshape(n_bins, bin_size)
+    value_bins = values[..., first:].reshape(values.shape[:-1] + (n_bins, bin_size))
+    if method == 'mean':
+        return time_bins.mean(axis=-1), value_bins.mean(axis=-1)
+    decimated_times = np.stack((time_bins[:, 0], time_bins[:, -1]), axis=-1).reshape(2 * n_bins)
+    decimated_values = np.stack((value_bins.min(axis=-1), value_bins.max(axis=-1)), axis=-1)
+    return decimated_times, decimated_values.reshape(values.shape[:-1] + (2 * n_bins,))
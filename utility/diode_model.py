@@ -0,0 +1,38 @@
+import numpy as np
+
+BOLTZMANN = 1.380649e-23
+ELEMENTARY_CHARGE = 1.602176634e-19
+ZERO_CELSIUS = 273.15
+
+
+def thermal_voltage(temperature=25.):
+    return BOLTZMANN * (temperature + ZERO_CELSIUS) / ELEMENTARY_CHARGE
+
+
+def lambertw_exp(x, iterations=8):
+    # W(exp(x)) by Newton iteration on w + log(w) = x, so that large arguments do not overflow exp
+    x = np.asarray(x, dtype=float)
+    w = np.where(x > 1., x - np.log(np.maximum(x, 1.)), np.exp(np.minimum(x, 1.)) / (1. + np.exp(np.minimum(x, 1.))))
+    for _ in range(iterations):
+        w = w * (1. + x - np.log(w)) / (1. + w)
+    return w
+
+
+def single_diode_current(v, iph, i0, nvt, rs, rsh):
+    # explicit solution of i = iph - i0 * (exp((v + i * rs) / nvt) - 1) - (v + i * rs) / rsh
+    v = np.asarray(v, dtype=float)
+    log_theta = (np.log(rs * rsh * i0 / (nvt * (rs + rsh))) +
+                 rsh * (rs * (iph + i0) + v) / (nvt * (rs + rsh)))
+    return (rsh * (iph + i0) - v) / (rs + rsh) - nvt / rs * lambertw_exp(log_theta)
+
+
+def single_diode_jacobian(v, i, iph, i0, nvt, rs, rsh):
+    # derivatives of the current with respect to iph, i0, nvt, rs and rsh at the points (v, i) on the curve, by implicit
+    # differentiation of i = iph - i0 * (exp((v + i * rs) / nvt) - 1) - (v + i * rs) / rsh
+    v, i = np.asarray(v, dtype=float), np.asarray(i, dtype=float)
+    vd = v + i * rs
+    diode = i0 * np.exp(vd / nvt)
+    denominator = 1. + diode * rs / nvt + rs / rsh
+    derivatives = (np.ones_like(vd), -np.expm1(vd / nvt), diode * vd / nvt ** 2, -i * (diode / nvt + 1. / rsh),
+                   vd / rsh ** 2)
+    return np.stack(derivatives, axis=-1) / denominator[..., np.newaxis]
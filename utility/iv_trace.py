@@ -0,0 +1,53 @@
+import numpy as np
+import pandas as pd
+import types
+
+TIME_COLUMN = 'Time (s)'
+VOLTAGE_COLUMN = 'Voltage (V)'
+CURRENT_COLUMN = 'Current (A)'
+
+
+class IVTrace:
+    """ Immutable IV trace, contiguous read-only float64 arrays of time, voltage and current plus metadata
+
+        The arrays are copied on construction, so a trace stays valid when the buffer it was read from is reused.
+        Metadata (e.g. mode, trace, arm_time) is kept in a read-only mapping.
+    """
+    __slots__ = ('time', 'voltage', 'current', 'metadata')
+
+    def __init__(self, voltage, current, time=None, **metadata):
+        voltage = np.array(voltage, dtype=float)
+        current = np.array(current, dtype=float)
+        time = np.full(len(voltage), np.nan) if time is None else np.array(time, dtype=float)
+        if not voltage.ndim == current.ndim == time.ndim == 1 or not len(voltage) == len(current) == len(time):
+            raise ValueError('Time, voltage and current must be 1D arrays of the same length.')
+        for name, values in (('time', time), ('voltage', voltage), ('current', current)):
+            values.setflags(write=False)
+            object.__setattr__(self, name, values)
+        object.__setattr__(self, 'metadata', types.MappingProxyType(dict(metadata)))
+
+    def __setattr__(self, name, value):
+        raise AttributeError('IVTrace is immutable.')
+
+    def __delattr__(self, name):
+        raise AttributeError('IVTrace is immutable.')
+
+    def __len__(self):
+        return len(self.voltage)
+
+    def __repr__(self):
+        return 'IVTrace(%d points%s)' % (len(self), ''.join(', %s=%r' % item for item in self.metadata.items()))
+
+    @classmethod
+    def from_frame(cls, df, **metadata):
+        time = df[TIME_COLUMN] if TIME_COLUMN in df else None
+        return cls(df[VOLTAGE_COLUMN], df[CURRENT_COLUMN], time, **metadata)
+
+    def to_frame(self):
+        # a DataFrame for export, with its own copy of the arrays
+        return pd.DataFrame({TIME_COLUMN: self.time, VOLTAGE_COLUMN: self.voltage, CURRENT_COLUMN: self.current})
+
+
+def as_trace(data):
+    # IVTrace of a trace or of a DataFrame with voltage and current columns
+    return data if isinstance(data, IVTrace) else IVTrace.from_frame(data)
@@ -0,0 +1,59 @@
+import numpy as np
+import threading
+
+
+class RingBuffer:
+    """ Fixed capacity history of column samples (e.g. a time row and one row per channel)
+
+        Every sample is written twice, at its slot and one capacity further on, so that the latest samples are always
+        a contiguous slice. Readers that keep the samples (plots) or run concurrently with extend copy or reduce
+        what they need under the lock (read), a view is only safe while the writer is held off, e.g. under a lock that
+        also guards extend.
+    """
+
+    def __init__(self, n_rows, capacity, dtype=float):
+        self.capacity = int(max(capacity, 1))
+        self.buffer = np.zeros((n_rows, 2 * self.capacity), dtype=dtype)
+        self.head = 0  # slot of the next sample
+        self.size = 0
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return self.size
+
+    def extend(self, samples):
+        # samples: (n_rows, n) array, only the last capacity samples are kept if n exceeds the capacity
+        samples = np.asarray(samples)[:, -self.capacity:]
+        n = samples.shape[1]
+        slots = (self.head + np.arange(n)) % self.capacity
+        with self.lock:
+            self.buffer[:, slots] = samples
+            self.buffer[:, slots + self.capacity] = samples
+            self.head = (self.head + n) % self.capacity
+            self.size = min(self.size + n, self.capacity)
+
+    def view(self, n=None):
+        # latest n (default all) samples, oldest first, as a read only view that later writes overwrite
+        with self.lock:
+            n = self.size if n is None else min(n, self.size)
+            start = (self.head - n) % self.capacity
+            view = self.buffer[:, start:start + n]
+        view.flags.writeable = False
+        return view
+
+    def read(self, function, n=None):
+        # function of the latest n (default all) samples, called on a view under the lock, so that it can copy or
+        # reduce just the part it needs, it must not keep the view
+        with self.lock:
+            n = self.size if n is None else min(n, self.size)
+            start = (self.head - n) % self.capacity
+            return function(self.buffer[:, start:start + n])
+
+    def latest(self):
+        with self.lock:
+            return self.buffer[:, (self.head - 1) % self.capacity].copy() if self.size else None
+
+    def clear(self):
+        with self.lock:
+            self.head = 0
+            self.size = 0
@@ -0,0 +1,42 @@
+import numpy as np
+
+
+class RunningStats:
+    """ Mean, standard deviation, min and max per channel, updated batch by batch in constant memory
+
+        Batches are merged into the accumulators with the parallel form of Welford's algorithm, so that no samples are
+        kept.
+    """
+
+    def __init__(self, n_channels):
+        self.count = 0
+        self.mean = np.zeros(n_channels)
+        self.m2 = np.zeros(n_channels)  # sum of squared deviations from the mean
+        self.min = np.full(n_channels, np.inf)
+        self.max = np.full(n_channels, -np.inf)
+
+    def update(self, samples):
+        # samples: (n_channels, n) array
+        n = samples.shape[1]
+        if n == 0:
+            return
+        batch_mean = samples.mean(axis=1)
+        batch_m2 = np.sum((samples - batch_mean[:, np.newaxis]) ** 2, axis=1)
+        total = self.count + n
+        delta = batch_mean - self.mean
+        self.mean = self.mean + delta * n / total
+        self.m2 = self.m2 + batch_m2 + delta ** 2 * self.count * n / total
+        self.count = total
+        self.min = np.minimum(self.min, samples.min(axis=1))
+        self.max = np.maximum(self.max, samples.max(axis=1))
+
+    @property
+    def std(self):
+        # sample standard deviation, 0 for a single sample
+        return np.sqrt(self.m2 / max(self.count - 1, 1))
+
+    def result(self, empty=-1.):
+        # mean, std, min and max as lists, filled with empty if there were no samples
+        if self.count == 0:
+            return [[empty] * len(self.mean) for _ in range(4)]
+        return [self.mean.tolist(), self.std.tolist(), self.min.tolist(), self.max.tolist()]